@@ -0,0 +1,135 @@
+import raw_io, synthetic
+import os, sys, time, json, shutil, argparse, tempfile
+import numpy as np
+
+"""
+Benchmarks for reading raw LMA data
+
+Everything runs on synthetic files made by the synthetic module, so this works
+anywhere and gives the same files every time (the random numbers are seeded).
+Results can be saved, and compared against a saved run to catch things that
+got slower.
+
+Usage: python benchmark_io.py [--quick] [--save results.json] [--compare baseline.json]
+"""
+
+#peaks per second at a station.  80us data tops out at 12500
+triggerRates = { 'quiet':200, 'active':2000, 'storm':10000 }
+
+def best_time( function, repeats ):
+    """
+    Run function repeats times, and return the fastest (seconds) and the last result
+    """
+    best = None
+    for i in range( repeats ):
+        tStart = time.perf_counter()
+        result = function()
+        dt = time.perf_counter() - tStart
+        if best is None or dt < best:
+            best = dt
+    return best, result
+
+def read_all_frames( lmaFile ):
+    frames = [ lmaFile.read_frame( i ) for i in range( 1, len( lmaFile.statusLocations ) ) ]
+    return sum( len( frame.nano ) for frame in frames )
+
+def iter_all_frames( lmaFile ):
+    return sum( len( frame.nano ) for frame in lmaFile.iter_frames() )
+
+def decimate_all_frames( frames, windowLength ):
+    for frame in frames:
+        frame.copy( inplace=False ).decimate( windowLength )
+
+def run_benchmarks( workDir, nSeconds, repeats ):
+    results = {}
+    def record( name, dt, count=None, unit=None ):
+        results[ name ] = dt
+        rate = '' if count is None else '%12.0f %s/s'%( count/dt, unit )
+        print( '%-36s %9.4f s %s'%( name, dt, rate ) )
+
+    startEpoch = 1685620800     #2023-06-01
+    for rateName, triggerRate in triggerRates.items():
+        path = os.path.join( workDir, 'v12_%s.dat'%rateName )
+        synthetic.write_raw_file( path, startEpoch, nSeconds=nSeconds, triggerRate=triggerRate, version=12, seed=12 )
+        size = os.path.getsize( path )
+
+        dt, lmaFile = best_time( lambda: raw_io.RawLMAFile( path ), repeats )
+        record( 'find_status backwards %s'%rateName, dt, nSeconds, 'frames' )
+        dt, rtFile = best_time( lambda: raw_io.RawLMAFile( path, decimated=True ), repeats )
+        record( 'find_status forwards %s'%rateName, dt, size/1e6, 'MB' )
+
+        dt, nPeaks = best_time( lambda: read_all_frames( lmaFile ), repeats )
+        record( 'read_frame %s'%rateName, dt, nPeaks, 'peaks' )
+        dt, nPeaks = best_time( lambda: iter_all_frames( lmaFile ), repeats )
+        record( 'iter_frames %s'%rateName, dt, nPeaks, 'peaks' )
+
+        frames = list( lmaFile.iter_frames() )
+        #the phasing uses the 80us windows, io_test decimates to 2ms
+        for windowLength in ( 80000, 2000000 ):
+            dt, _ = best_time( lambda: decimate_all_frames( frames, windowLength ), repeats )
+            record( 'decimate %ius %s'%( windowLength//1000, rateName ), dt, nPeaks, 'peaks' )
+        lmaFile.close()
+        rtFile.close()
+
+    #the older data versions
+    for version in ( 8, 9 ):
+        path = os.path.join( workDir, 'v%i_active.dat'%version )
+        synthetic.write_raw_file( path, startEpoch, nSeconds=nSeconds, triggerRate=triggerRates['active'], version=version, seed=version )
+        dt, lmaFile = best_time( lambda: raw_io.RawLMAFile( path ), repeats )
+        record( 'find_status backwards v%i'%version, dt, nSeconds, 'frames' )
+        dt, rtFile = best_time( lambda: raw_io.RawLMAFile( path, decimated=True ), repeats )
+        record( 'find_status forwards v%i'%version, dt, os.path.getsize( path )/1e6, 'MB' )
+        dt, nPeaks = best_time( lambda: read_all_frames( lmaFile ), repeats )
+        record( 'read_frame v%i'%version, dt, nPeaks, 'peaks' )
+        lmaFile.close()
+        rtFile.close()
+
+    #a big network's location file
+    locPath = os.path.join( workDir, 'loc.txt' )
+    synthetic.make_loc_file( nStations=26, seed=0 ).write( locPath )
+    nReads = 100
+    dt, _ = best_time( lambda: [ raw_io.LocFile( locPath ) for i in range( nReads ) ], repeats )
+    record( 'LocFile.read x%i'%nReads, dt, nReads, 'files' )
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Benchmark raw LMA data reading on synthetic files' )
+    parser.add_argument( '--quick', action='store_true', help='1 minute files instead of 10 minute files' )
+    parser.add_argument( '--repeats', type=int, default=3, help='best of this many runs is reported' )
+    parser.add_argument( '--save', help='write the results to this json file' )
+    parser.add_argument( '--compare', help='compare against results saved with --save' )
+    parser.add_argument( '--tolerance', type=float, default=1.25, help='slower than this ratio is a regression' )
+    parser.add_argument( '--workdir', help='where the synthetic files go, a temporary directory by default' )
+    args = parser.parse_args()
+
+    nSeconds = 60 if args.quick else 600
+    workDir  = args.workdir or tempfile.mkdtemp( prefix='lmabenchmark' )
+    if not os.path.exists( workDir ):
+        os.makedirs( workDir )
+    try:
+        results = run_benchmarks( workDir, nSeconds, args.repeats )
+    finally:
+        if args.workdir is None:
+            shutil.rmtree( workDir )
+
+    if args.save:
+        with open( args.save, 'w' ) as outputFile:
+            json.dump( { 'nSeconds':nSeconds, 'results':results }, outputFile, indent=1 )
+
+    if args.compare:
+        with open( args.compare ) as inputFile:
+            baseline = json.load( inputFile )
+        if baseline['nSeconds'] != nSeconds:
+            print( 'Baseline used %i second files, this run used %i'%(baseline['nSeconds'], nSeconds) )
+        regressions = 0
+        print( '\n%-36s %9s %9s %6s'%( 'benchmark', 'baseline', 'now', 'ratio' ) )
+        for name, dt in results.items():
+            if name not in baseline['results']:
+                continue
+            ratio = dt/baseline['results'][ name ]
+            flag  = '  <-- slower' if ratio > args.tolerance else ''
+            regressions += ratio > args.tolerance
+            print( '%-36s %9.4f %9.4f %6.2f%s'%( name, baseline['results'][name], dt, ratio, flag ) )
+        if regressions:
+            sys.exit( 1 )
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+#
+"""catalog
+Keeps track of which raw LMA files cover which stations and epochs
+
+Only the first and last status packets of each file are read, which is
+enough to get the station, network, version, and the epochs the file covers.
+The catalog is kept in a sqlite database so it only has to be built once
+"""
+
+import os, sqlite3, fnmatch, warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+#TODO - change to relative imports
+from raw_io import StatusPacket, check_status_packets, status_id_bits
+from compressed import CompressedFile, compression_type
+
+#the columns of the files table
+catalogColumns = ( 'path', 'id', 'netid', 'version', 'startEpoch', 'endEpoch', 'size', 'mtime' )
+
+def read_file_summary( inputPath, tailSize=65536 ):
+    """
+    Get the station and epoch information for a raw data file from its first
+    and last status packets
+
+    inputPath = path to lma data file
+    tailSize  = how much of the end of the file to search for the last status
+                packet, if it isn't right at the end (real time files can be cut off)
+
+    returns a dict with the catalogColumns
+    """
+    stat = os.stat( inputPath )
+    if compression_type( inputPath ) is None:
+        inputFile = open( inputPath, 'rb' )
+        fileSize  = stat.st_size
+    else:
+        inputFile = CompressedFile( inputPath )
+        fileSize  = inputFile.size
+
+    with inputFile:
+        def read( fileLocation, size ):
+            inputFile.seek( fileLocation )
+            return inputFile.read( size )
+
+        #the first status packet is at the start of the file
+        #it has no data, it's startEpoch is 1 less than the first frame
+        statusPacket = StatusPacket( read( 0, 18 ) )
+        version = statusPacket.version
+        statusSize = 18 if version >= 10 else 12
+        idBits = status_id_bits( np.array( [statusPacket.words] ), version )[0]
+
+        #the last status packet is usually the last thing in the file
+        lastLocation = None
+        tailStart = fileSize
+        while lastLocation is None and tailStart > 0:
+            tailStart = max( fileSize - tailSize, 0 )
+            tail = np.frombuffer( read( tailStart, fileSize-tailStart ), dtype='u1' )
+            lastLocation = _last_status( tail, version, statusSize, idBits )
+            if lastLocation is not None:
+                lastLocation += tailStart
+            tailSize *= 4
+        if lastLocation is None or lastLocation == 0:
+            #there's only the one status packet
+            endEpoch = statusPacket.epoch
+        else:
+            endEpoch = StatusPacket( read( lastLocation, statusSize ) ).epoch
+
+    return { 'path':os.path.abspath( inputPath ), 'id':statusPacket.id, 'netid':statusPacket.netid,
+             'version':version, 'startEpoch':statusPacket.epoch+1, 'endEpoch':endEpoch,
+             'size':stat.st_size, 'mtime':stat.st_mtime_ns }
+
+def _last_status( data, version, statusSize, idBits ):
+    """
+    File location (in data) of the last status packet in data, or None
+    """
+    nWords = statusSize//2
+    if len( data ) < statusSize:
+        return None
+    #every word in a status packet is negative, the top bit of the second byte is set
+    highBit = data >= 0x80
+    windows = np.lib.stride_tricks.sliding_window_view( highBit[1:], statusSize-1 )[:,::2]
+    candidates = np.flatnonzero( windows.all( axis=1 ) )
+    if len( candidates ) == 0:
+        return None
+    words = data[ candidates[:,None] + np.arange( statusSize ) ].view( '<i2' ).reshape( -1, nWords )
+    valid = check_status_packets( words, version )
+    valid &= ( status_id_bits( words, version ) == idBits ).all( axis=1 )
+    if not valid.any():
+        return None
+    return int( candidates[ valid ][-1] )
+
+class Catalog:
+
+    def __init__( self, catalogPath=':memory:' ):
+        """
+        catalogPath = the sqlite database file.  It's made if it doesn't exist
+        """
+        self.catalogPath = catalogPath
+        #the pool threads only read files, all the database stuff happens here
+        self.db = sqlite3.connect( catalogPath )
+        self.db.row_factory = sqlite3.Row
+        self.db.execute( '''CREATE TABLE IF NOT EXISTS files (
+                                path TEXT PRIMARY KEY, id TEXT, netid, version INTEGER,
+                                startEpoch INTEGER, endEpoch INTEGER, size INTEGER, mtime INTEGER )''' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS files_epochs ON files ( netid, startEpoch, endEpoch )' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS files_id ON files ( id, startEpoch )' )
+        self.db.commit()
+
+    def add( self, inputPaths, workers=None ):
+        """
+        Add files to the catalog.  Files that are already in it and haven't
+        changed are skipped
+
+        inputPaths = list of raw data files
+        workers    = number of threads reading files
+
+        returns the number of files added
+        """
+        known = { row['path']:( row['size'], row['mtime'] ) for row in self.db.execute( 'SELECT path, size, mtime FROM files' ) }
+        todo = []
+        for inputPath in inputPaths:
+            inputPath = os.path.abspath( inputPath )
+            stat = os.stat( inputPath )
+            if known.get( inputPath ) != ( stat.st_size, stat.st_mtime_ns ):
+                todo.append( inputPath )
+
+        def summary( inputPath ):
+            try:
+                return read_file_summary( inputPath )
+            except Exception as e:
+                #not everything in an archive is going to be good
+                warnings.warn( 'Catalog.add - could not read %s: %s'%(inputPath, e) )
+                return None
+
+        with ThreadPoolExecutor( max_workers=workers ) as pool:
+            summaries = [ s for s in pool.map( summary, todo ) if s is not None ]
+
+        self.db.executemany( 'INSERT OR REPLACE INTO files VALUES ( %s )'%','.join( ':'+c for c in catalogColumns ), summaries )
+        self.db.commit()
+        return len( summaries )
+
+    def add_directory( self, directory, pattern='*.dat*', workers=None ):
+        """
+        Add all the files under directory (recursively) with names matching pattern
+        """
+        inputPaths = []
+        for root, dirs, files in os.walk( directory ):
+            inputPaths += [ os.path.join( root, f ) for f in fnmatch.filter( files, pattern ) ]
+        return self.add( sorted( inputPaths ), workers=workers )
+
+    def remove_missing( self ):
+        """
+        Take files that don't exist anymore out of the catalog
+        """
+        missing = [ (row['path'],) for row in self.db.execute( 'SELECT path FROM files' ) if not os.path.exists( row['path'] ) ]
+        self.db.executemany( 'DELETE FROM files WHERE path = ?', missing )
+        self.db.commit()
+        return len( missing )
+
+    def query( self, startEpoch=None, endEpoch=None, netid=None, id=None ):
+        """
+        Find the files that have data between startEpoch and endEpoch
+        (inclusive), for the network netid and station id.  Anything left
+        as None isn't used
+
+        returns a list of dicts with the catalogColumns, sorted by station and startEpoch
+        """
+        where  = []
+        values = []
+        if startEpoch is not None:
+            where.append( 'endEpoch >= ?' )
+            values.append( int( startEpoch ) )
+        if endEpoch is not None:
+            where.append( 'startEpoch <= ?' )
+            values.append( int( endEpoch ) )
+        if netid is not None:
+            where.append( 'netid = ?' )
+            values.append( netid )
+        if id is not None:
+            where.append( 'id = ?' )
+            values.append( id )
+        sql = 'SELECT * FROM files'
+        if where:
+            sql += ' WHERE ' + ' AND '.join( where )
+        sql += ' ORDER BY id, startEpoch'
+        return [ dict( row ) for row in self.db.execute( sql, values ) ]
+
+    def paths( self, *args, **kwargs ):
+        """
+        Same as query, but just the paths.  These can go straight to NetworkReader
+        """
+        return [ row['path'] for row in self.query( *args, **kwargs ) ]
+
+    def __len__( self ):
+        return self.db.execute( 'SELECT COUNT(*) FROM files' ).fetchone()[0]
+
+    def close( self ):
+        self.db.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
@@ -1,6 +1,6 @@
-import os, sys, warnings
+import os, sys, re, warnings
 import numpy as np
-import time, calendar   #I am forever annoyed that both are needed
+import time
 
 #local imports, these will have to be updated later
 import distance
@@ -11,6 +11,14 @@ from constants import *
 # the 'modern' way is to do everything in datetime, but the church of datetime
 # wants you to stay in the church of datetime, and I really just want an epoch and a nano
 def timestamp2epoch( timestamp ):
+    """
+    Converts a timestamp string (like 20230601T12:00:00) into epoch seconds
+    timestamp can also be a list/array of timestamp strings, in which case 
+    you get back an array of epochs
+    """
+    if not isinstance( timestamp, str ):
+        return _timestamps2epochs( timestamp )
+
     #strip all non-numbers from the timeStamp
     strippedTimestamp = ''
     for c in timestamp:
@@ -22,11 +30,63 @@ def timestamp2epoch( timestamp ):
         #fill with 0's
         strippedTimestamp += '0'*(14-len(strippedTimestamp))
 
-    #return epoch seconds, and nano seconds back
-    return calendar.timegm( time.strptime( strippedTimestamp[:14], '%Y%m%d%H%M%S' ) )
+    s = strippedTimestamp
+    fields = int(s[:4]), int(s[4:6]), int(s[6:8]), int(s[8:10]), int(s[10:12]), int(s[12:14])
+    if not valid_civil( *fields ):
+        raise ValueError( 'timestamp2epoch - invalid timestamp %s'%timestamp )
+    return civil2epoch( *fields )
+
+def _timestamps2epochs( timestamps ):
+    #bulk version of timestamp2epoch
+    #stripping out the non-numbers still has to be done one at a time, 
+    #but everything after that is array math
+    strippedTimestamps = [ re.sub( r'[^0-9]', '', t ).ljust( 14, '0' )[:14] for t in timestamps ]
+    digits = np.array( strippedTimestamps, dtype='S14' ).view( 'u1' ).reshape( -1, 14 ).astype( 'i8' ) - ord('0')
+    #powers of ten to turn digits back into numbers
+    def number( i0, i1 ):
+        return ( digits[:,i0:i1] * 10**np.arange( i1-i0-1, -1, -1 ) ).sum( axis=1 )
+    fields = number(0,4), number(4,6), number(6,8), number(8,10), number(10,12), number(12,14)
+    if not valid_civil( *fields ).all():
+        raise ValueError( 'timestamp2epoch - invalid timestamps' )
+    return civil2epoch( *fields )
+
+#days in each month, February gets 1 more in leap years
+_daysInMonth = np.array( [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31] )
+
+def valid_civil( year, month, day, hour, minute, second ):
+    """
+    The same range checks strptime does, including the length of the month
+    Works for numbers, or numpy arrays of them
+    """
+    year  = np.asarray( year )
+    month = np.asarray( month )
+    leap  = ( year%4 == 0 ) & ( ( year%100 != 0 ) | ( year%400 == 0 ) )
+    monthLength = _daysInMonth[ np.clip( month, 1, 12 )-1 ] + ( leap & ( month == 2 ) )
+    return (month>=1) & (month<=12) & (day>=1) & (day<=monthLength) & (hour<=23) & (minute<=59) & (second<=61)
+
+def days_from_civil( year, month, day ):
+    """
+    Number of days since 1970-01-01 for a date in the (proleptic) Gregorian calendar
+    This is just integer math, so it works for numbers or numpy arrays of them
+    Algorithm from http://howardhinnant.github.io/date_algorithms.html
+    """
+    #count years from March, so the leap day is the last day of the year
+    year = year - (month <= 2)
+    era  = year // 400
+    yoe  = year - era*400                                   #year of era [0, 399]
+    doy  = ( 153*( (month+9)%12 ) + 2 )//5 + day-1          #day of year [0, 365]
+    doe  = yoe*365 + yoe//4 - yoe//100 + doy                #day of era  [0, 146096]
+    return era*146097 + doe - 719468
+
+def civil2epoch( year, month, day, hour=0, minute=0, second=0 ):
+    """
+    Converts numerical values for year/month/day/hour/minute/second into an epoch
+    Works for numbers, or for numpy arrays of them
+    """
+    return days_from_civil( year, month, day )*86400 + hour*3600 + minute*60 + second
 
 def epoch2timestamp( epoch ):
-    return time.strftime( '%Y-%m-%dT%H:%M:%S', time.gmtime( t ) )
+    return time.strftime( '%Y-%m-%dT%H:%M:%S', time.gmtime( epoch ) )
 
 def latlonalt2xyz( lat,lon,alt ):
     #https://doi.org/10.1016/j.cageo.2019.104308
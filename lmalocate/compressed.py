@@ -0,0 +1,445 @@
+#!/usr/bin/python
+#
+"""compressed
+Random access reading of gzip, bz2, and xz compressed files
+
+The first time a file is opened, it's decompressed all the way through once to
+find the size, and checkpoints are saved along the way.  After that, a read
+only has to decompress from the nearest checkpoint before it.
+  gzip  - a checkpoint is saved at the first deflate block boundary after every 
+          checkpointSpacing bytes.  It's the last 32k of uncompressed data and 
+          the bit the block starts on, which is everything a raw deflate 
+          decompressor needs to start there.  Finding the block boundaries 
+          needs libz through ctypes, without it gzip is treated like bz2
+  bz2   - the decompressors can't be restarted in the middle, so there are only
+  xz      checkpoints at the start of each stream.  Files made with pbzip2 or 
+          lbzip2 have lots of streams, a plain bzip2 or xz file has only 1
+
+The checkpoints are all numbers and bytes, so get_index can be saved and 
+passed back in the next time the file is opened to skip the decompression
+"""
+
+import zlib, bz2, lzma, threading, itertools, bisect, ctypes, ctypes.util
+from collections import OrderedDict
+import numpy as np
+
+#the first few bytes of each type of file
+magicNumbers = { 'gzip':b'\x1f\x8b',
+                 'bz2' :b'BZh',
+                 'xz'  :b'\xfd7zXZ\x00' }
+
+#deflate back references go at most this far
+windowSize = 32768
+
+def compression_type( inputPath ):
+    """
+    returns 'gzip', 'bz2', 'xz', or None if the file doesn't look compressed
+    """
+    with open( inputPath, 'rb' ) as inputFile:
+        head = inputFile.read( 6 )
+    for name, magic in magicNumbers.items():
+        if head.startswith( magic ):
+            return name
+    return None
+
+def new_decompressor( compression ):
+    if compression == 'gzip':
+        #31 is the gzip header with the biggest window
+        return zlib.decompressobj( 31 )
+    elif compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    elif compression == 'xz':
+        return lzma.LZMADecompressor()
+    raise Exception( 'compressed.new_decompressor - unknown compression type %s'%compression )
+
+###
+# libz, for finding deflate block boundaries
+# the zlib module can't stop at the end of a block or say what bit it's on
+
+class _ZStream( ctypes.Structure ):
+    _fields_ = [ ('next_in', ctypes.c_void_p), ('avail_in', ctypes.c_uint), ('total_in', ctypes.c_ulong),
+                 ('next_out', ctypes.c_void_p), ('avail_out', ctypes.c_uint), ('total_out', ctypes.c_ulong),
+                 ('msg', ctypes.c_char_p), ('state', ctypes.c_void_p), 
+                 ('zalloc', ctypes.c_void_p), ('zfree', ctypes.c_void_p), ('opaque', ctypes.c_void_p),
+                 ('data_type', ctypes.c_int), ('adler', ctypes.c_ulong), ('reserved', ctypes.c_ulong) ]
+
+_Z_OK, _Z_STREAM_END, _Z_BUF_ERROR, _Z_BLOCK = 0, 1, -5, 5
+
+def _load_libz():
+    libzName = ctypes.util.find_library( 'z' )
+    if libzName is None:
+        return None
+    try:
+        libz = ctypes.CDLL( libzName )
+    except OSError:
+        return None
+    libz.zlibVersion.restype = ctypes.c_char_p
+    libz.inflateInit2_.argtypes = [ ctypes.POINTER( _ZStream ), ctypes.c_int, ctypes.c_char_p, ctypes.c_int ]
+    libz.inflate.argtypes = [ ctypes.POINTER( _ZStream ), ctypes.c_int ]
+    libz.inflateReset.argtypes = [ ctypes.POINTER( _ZStream ) ]
+    libz.inflateEnd.argtypes = [ ctypes.POINTER( _ZStream ) ]
+    return libz
+
+_libz = _load_libz()
+
+###
+# empty deflate blocks, for starting a raw decompressor part way through a byte
+# the decompressor has to be fed whole bytes, so the bits of the byte before 
+# the block boundary get replaced with blocks that don't do anything
+
+def _bit_writer():
+    bits = []
+    def put( value, n ):
+        #header fields go least significant bit first
+        bits.extend( (value>>i)&1 for i in range( n ) )
+    def code( value, n ):
+        #huffman codes go most significant bit first
+        bits.extend( (value>>i)&1 for i in reversed( range( n ) ) )
+    return bits, put, code
+
+def _empty_blocks( nBits ):
+    """
+    bits for empty (not final) deflate blocks, the number of bits is nBits mod 8
+    """
+    bits, put, code = _bit_writer()
+    if nBits%2:
+        #a fixed block is 10 bits, so the odd ones need a dynamic block (95 bits)
+        #the only literal/length code is end of block, with length 1
+        put( 0, 1 ); put( 2, 2 )
+        #257 literal/length codes, 1 distance code, 19 code length codes
+        put( 0, 5 ); put( 0, 5 ); put( 15, 4 )
+        #code length code lengths.  Only 18 (run of 0s), 0, and 1 are used
+        codeLengths = { 18:1, 0:2, 1:2 }
+        for symbol in ( 16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15 ):
+            put( codeLengths.get( symbol, 0 ), 3 )
+        #256 zeros for the literals, 138+118
+        code( 0, 1 ); put( 138-11, 7 )
+        code( 0, 1 ); put( 118-11, 7 )
+        #1 for end of block, 0 for the distance code
+        code( 3, 2 ); code( 2, 2 )
+        #the block itself is just end of block
+        code( 0, 1 )
+    while len( bits )%8 != nBits%8:
+        #fixed block with just end of block
+        put( 0, 1 ); put( 1, 2 ); code( 0, 7 )
+    return bits
+
+_emptyBlocks = [ _empty_blocks( nBits ) for nBits in range( 8 ) ]
+
+def _prime( bits, byte ):
+    """
+    bytes to feed a raw decompressor before the rest of the file, for a block 
+    that starts with the top bits bits of byte
+    """
+    primeBits = _emptyBlocks[ -bits%8 ] + [ (byte>>i)&1 for i in range( 8-bits, 8 ) ]
+    return np.packbits( np.array( primeBits, dtype='u1' ), bitorder='little' ).tobytes()
+
+class CompressedFile:
+
+    def __init__( self, inputPath, checkpointSpacing=4*1024**2, maxBlocks=8, index=None ):
+        """
+        File like object (read/seek/tell) for reading a compressed file
+
+        inputPath         = path to the compressed file
+        checkpointSpacing = uncompressed bytes between gzip checkpoints.  This is also
+                            the size of the blocks that get decompressed and kept
+        maxBlocks         = how many decompressed blocks to keep in memory
+        index             = what get_index returned the last time this file was 
+                            opened.  If None, the file is decompressed once to make it
+        """
+        self.inputPath   = inputPath
+        self.compression = compression_type( inputPath )
+        if self.compression is None:
+            raise Exception( 'CompressedFile.__init__: %s is not gzip, bz2, or xz'%inputPath )
+        self.checkpointSpacing = checkpointSpacing
+        self.maxBlocks = maxBlocks
+
+        self.inputFile = open( inputPath, 'rb' )
+        self._position = 0
+        self._blocks   = OrderedDict()
+        self._lock     = threading.Lock()
+        #where we left off the last time we decompressed something
+        #reading the next block continues from here instead of a checkpoint
+        self._cursor   = None
+
+        if index is None:
+            self.build_index()
+        else:
+            self.set_index( index )
+
+    def build_index( self ):
+        """
+        Go through the whole file once, saving checkpoints
+        Each checkpoint is (uncompressed location, compressed location, bits, window)
+        The window is None at the start of a stream, otherwise the block starts 
+        with the top bits bits of the byte before the compressed location
+        """
+        if self.compression == 'gzip' and _libz is not None:
+            self._build_gzip_index()
+            return
+        #there's only checkpoints at the start of streams
+        self.checkpoints = [ (0, 0, 0, None) ]
+        size = 0
+        for uLoc, data, nextU, nextC, decompressor, raw in self._decompress( 0, 0, None ):
+            if decompressor is None:
+                self.checkpoints.append( ( nextU, nextC, 0, None ) )
+            size = nextU
+        self.size = size
+
+    def _build_gzip_index( self, chunkSize=256*1024 ):
+        """
+        build_index for gzip files, this stops at every deflate block boundary 
+        (that's what zran.c in the zlib examples does)
+        """
+        self.checkpoints = [ (0, 0, 0, None) ]
+        stream    = _ZStream()
+        streamRef = ctypes.byref( stream )
+        if _libz.inflateInit2_( streamRef, 31, _libz.zlibVersion(), ctypes.sizeof( stream ) ) != _Z_OK:
+            raise Exception( 'CompressedFile._build_gzip_index - inflateInit2 failed' )
+        #the output goes round and round a buffer the size of the window
+        window   = ctypes.create_string_buffer( windowSize )
+        inBuffer = ctypes.create_string_buffer( chunkSize )
+        cRead = 0       #how much of the file has been read into inBuffer
+        uLoc  = 0
+        streamStart = 0 #uncompressed location of the start of this stream
+        lastCheckpoint = 0
+        fresh = True
+        self.inputFile.seek( 0 )
+        try:
+            while True:
+                if stream.avail_in == 0:
+                    n = self.inputFile.readinto( memoryview( inBuffer ) )
+                    if n == 0:
+                        break
+                    cRead += n
+                    stream.next_in  = ctypes.addressof( inBuffer )
+                    stream.avail_in = n
+                if stream.avail_out == 0:
+                    stream.next_out  = ctypes.addressof( window )
+                    stream.avail_out = windowSize
+                availOut = stream.avail_out
+                ret = _libz.inflate( streamRef, _Z_BLOCK )
+                uLoc += availOut - stream.avail_out
+                cLoc  = cRead - stream.avail_in
+                if ret == _Z_STREAM_END:
+                    #the stuff after the end of the stream is the next stream, if there is one
+                    self.checkpoints.append( ( uLoc, cLoc, 0, None ) )
+                    _libz.inflateReset( streamRef )
+                    streamStart = lastCheckpoint = uLoc
+                    fresh = True
+                    continue
+                if ret not in ( _Z_OK, _Z_BUF_ERROR ):
+                    if fresh:
+                        #junk after the last stream, which is allowed
+                        break
+                    raise Exception( 'CompressedFile._build_gzip_index - error decompressing %s at %i: %s'%(
+                                     self.inputPath, cLoc, stream.msg ) )
+                fresh = False
+                #128 is the end of a block (or the header), 64 is the last block
+                if stream.data_type & 128 and not stream.data_type & 64 and uLoc-lastCheckpoint >= self.checkpointSpacing:
+                    #the last windowSize bytes of output, which start where the output goes next
+                    iOut = windowSize - stream.avail_out
+                    self.checkpoints.append( ( uLoc, cLoc, stream.data_type&7, window.raw[ iOut: ] + window.raw[ :iOut ] ) )
+                    lastCheckpoint = uLoc
+        finally:
+            _libz.inflateEnd( streamRef )
+        self.size = uLoc
+
+    def get_index( self ):
+        """
+        The checkpoints as a dict of numpy arrays, which can be saved (np.savez) 
+        and passed to __init__ or set_index the next time
+        """
+        windows = np.zeros( ( len( self.checkpoints ), windowSize ), dtype='u1' )
+        for i, checkpoint in enumerate( self.checkpoints ):
+            if checkpoint[3] is not None:
+                windows[i] = np.frombuffer( checkpoint[3], dtype='u1' )
+        return { 'size':np.int64( self.size ),
+                 'uLoc':np.array( [ c[0] for c in self.checkpoints ], dtype='i8' ),
+                 'cLoc':np.array( [ c[1] for c in self.checkpoints ], dtype='i8' ),
+                 'bits':np.array( [ c[2] for c in self.checkpoints ], dtype='i1' ),
+                 'hasWindow':np.array( [ c[3] is not None for c in self.checkpoints ], dtype=bool ),
+                 'windows':windows }
+
+    def set_index( self, index ):
+        """
+        Use checkpoints from get_index instead of building them
+        """
+        self.size = int( index['size'] )
+        self.checkpoints = [ ( int( uLoc ), int( cLoc ), int( bits ), window.tobytes() if hasWindow else None )
+                             for uLoc, cLoc, bits, hasWindow, window in zip( index['uLoc'], index['cLoc'], index['bits'], 
+                                                                             index['hasWindow'], index['windows'] ) ]
+        self._blocks.clear()
+        self._cursor = None
+
+    def _restore( self, checkpoint ):
+        """
+        Arguments for _decompress to start at a checkpoint
+        """
+        uLoc, cLoc, bits, window = checkpoint
+        if window is None:
+            return uLoc, cLoc, None, False, b''
+        #a raw deflate decompressor, which already has the window
+        decompressor = zlib.decompressobj( -15, zdict=window )
+        head = b''
+        if bits:
+            self.inputFile.seek( cLoc-1 )
+            head = _prime( bits, self.inputFile.read( 1 )[0] )
+        return uLoc, cLoc, decompressor, True, head
+
+    def _decompress( self, uLoc, cLoc, decompressor, raw=False, head=b'', chunkSize=256*1024 ):
+        """
+        Generator that decompresses from a checkpoint to the end of the file
+
+        raw  - True if decompressor is a raw deflate one, which stops before the gzip trailer
+        head - bytes to decompress before the ones at cLoc
+
+        yields ( uncompressed location, data, next uncompressed location, 
+                 next compressed location, decompressor, raw )
+        The last 4 are where to start for the data after this chunk.  decompressor 
+        is None if that's the start of a new stream
+        """
+        fresh = decompressor is None
+        if fresh:
+            decompressor = new_decompressor( self.compression )
+            raw = False
+        self.inputFile.seek( cLoc )
+        while True:
+            chunk = self.inputFile.read( chunkSize )
+            if not chunk:
+                return
+            cLoc += len( chunk )
+            if head:
+                chunk = head + chunk
+                head  = b''
+            try:
+                data = decompressor.decompress( chunk )
+            except ( OSError, EOFError, zlib.error, lzma.LZMAError ):
+                if fresh:
+                    #junk after the last stream, which is allowed
+                    return
+                raise
+            fresh = False
+            if decompressor.eof:
+                #the stuff after the end of the stream is the next stream, if there is one
+                cLoc -= len( decompressor.unused_data )
+                if raw:
+                    #the crc and size at the end of the gzip stream
+                    cLoc += 8
+                self.inputFile.seek( cLoc )
+                decompressor = new_decompressor( self.compression )
+                raw   = False
+                fresh = True
+            yield uLoc, data, uLoc+len( data ), cLoc, None if fresh else decompressor, raw
+            uLoc += len( data )
+
+    def _read_block( self, iBlock ):
+        """
+        Decompressed data for uncompressed locations iBlock*checkpointSpacing
+        up to the next block.  Blocks before it that get decompressed on the 
+        way are kept too, so reading backwards isn't terrible
+        """
+        if iBlock in self._blocks:
+            self._blocks.move_to_end( iBlock )
+            return self._blocks[ iBlock ]
+
+        blockSize = self.checkpointSpacing
+        start = iBlock*blockSize
+        #the last checkpoint before the start of the block
+        iCheckpoint = bisect.bisect_right( [ c[0] for c in self.checkpoints ], start )-1
+        uLoc, cLoc, decompressor, raw, head = self._restore( self.checkpoints[ iCheckpoint ] )
+        chunks = self._decompress( uLoc, cLoc, decompressor, raw, head )
+        #pick up where we left off if that's closer
+        if self._cursor is not None and uLoc <= self._cursor[0] <= start:
+            uLoc = self._cursor[0]
+            chunks = itertools.chain( [self._cursor], self._decompress( *self._cursor[2:] ) )
+        self._cursor = None
+
+        #we can only keep blocks we have all of
+        jBlock = -( -uLoc//blockSize )
+        pieces = []
+        #a chunk can cover more than maxBlocks blocks, so the block we want
+        #might not be in _blocks by the time we're done.  Hang on to it here
+        wanted = None
+        for chunk in chunks:
+            uLoc, data, nextU = chunk[:3]
+            position = uLoc
+            while position < nextU:
+                if position < jBlock*blockSize:
+                    position = min( jBlock*blockSize, nextU )
+                    continue
+                blockStop = ( jBlock+1 )*blockSize
+                piece = data[ position-uLoc:blockStop-uLoc ]
+                pieces.append( piece )
+                position += len( piece )
+                if position >= blockStop:
+                    block = b''.join( pieces )
+                    self._keep_block( jBlock, block )
+                    if jBlock == iBlock:
+                        wanted = block
+                    pieces = []
+                    jBlock += 1
+            if jBlock > iBlock:
+                #the next block starts in this chunk, this is where to start for it
+                #the generator is abandoned, so we can have it's decompressor
+                self._cursor = chunk
+                break
+        else:
+            #end of the file, the last block is short
+            if jBlock <= iBlock:
+                block = b''.join( pieces )
+                self._keep_block( jBlock, block )
+                if jBlock == iBlock:
+                    wanted = block
+
+        return wanted if wanted is not None else b''
+
+    def _keep_block( self, iBlock, block ):
+        self._blocks[ iBlock ] = block
+        self._blocks.move_to_end( iBlock )
+        while len( self._blocks ) > self.maxBlocks:
+            self._blocks.popitem( last=False )
+
+    def read( self, size=-1 ):
+        with self._lock:
+            if size < 0:
+                size = self.size - self._position
+            size  = max( min( size, self.size-self._position ), 0 )
+            start = self._position
+            pieces = []
+            while start < self._position+size:
+                iBlock = start//self.checkpointSpacing
+                block  = self._read_block( iBlock )
+                offset = start - iBlock*self.checkpointSpacing
+                piece  = block[ offset:offset+self._position+size-start ]
+                if not piece:
+                    #size was already cut down to the end of the file, so this is missing data
+                    raise Exception( 'CompressedFile.read - could only read %i of %i bytes at %i in %s'%(
+                                     start-self._position, size, self._position, self.inputPath ) )
+                pieces.append( piece )
+                start += len( piece )
+            self._position = start
+            return b''.join( pieces )
+
+    def seek( self, offset, whence=0 ):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.size
+        self._position = max( offset, 0 )
+        return self._position
+
+    def tell( self ):
+        return self._position
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def close( self ):
+        self.inputFile.close()
+        self._blocks.clear()
+        self._cursor = None
+        self.checkpoints = []
@@ -1,5 +1,6 @@
-import raw_io
-import glob
+import raw_io, synthetic, compressed
+import os, bz2, gzip, glob, shutil, tempfile, warnings
+import numpy as np
 
 """
 This is a script used to test some/most features of the 
@@ -8,46 +9,146 @@ Also, I keep tearing it to the ground, and re-writing it.
 -- this may not function in environments other than my own
 """
 
+###
+# checks that make their own data, these work anywhere
+def check_cache_poll():
+    """
+    A real time file opened from the status cache should still be able to poll
+    """
+    workDir = tempfile.mkdtemp( prefix='lmaiotest' )
+    try:
+        path = os.path.join( workDir, 'rt.dat' )
+        synthetic.write_raw_file( path, 1685620800, nSeconds=30, triggerRate=2000, decimateWindow=80000, seed=1 )
+        with open( path, 'rb' ) as inputFile:
+            data = inputFile.read()
+        lmaFile = raw_io.RawLMAFile( path, decimated=True )
+        nStatus = len( lmaFile.statusLocations )
+        cut = int( lmaFile.statusLocations[15] ) + lmaFile.statusSize
+        lmaFile.close()
+
+        #the first half of the file, opened twice so the second time uses the cache
+        with open( path, 'wb' ) as outputFile:
+            outputFile.write( data[:cut] )
+        raw_io.RawLMAFile( path, decimated=True, cache=True ).close()
+        lmaFile = raw_io.RawLMAFile( path, decimated=True, cache=True )
+        with open( path, 'ab' ) as outputFile:
+            outputFile.write( data[cut:] )
+        frames = lmaFile.poll()
+        assert len( lmaFile.statusLocations ) == nStatus, 'poll after a cache load missed status packets'
+        assert len( frames ) == nStatus-16, 'poll after a cache load missed frames'
+        lmaFile.close()
+    finally:
+        shutil.rmtree( workDir )
+    print( 'check_cache_poll ok' )
+
+def check_compressed_read():
+    """
+    Random reads of a compressed file where 1 chunk decompresses to more blocks than are kept
+    """
+    workDir = tempfile.mkdtemp( prefix='lmaiotest' )
+    try:
+        rng  = np.random.default_rng( 0 )
+        data = rng.integers( 0, 4, 1024**2, dtype='u1' ).tobytes()
+        path = os.path.join( workDir, 'data.bz2' )
+        with open( path, 'wb' ) as outputFile:
+            outputFile.write( bz2.compress( data ) )
+        with compressed.CompressedFile( path, checkpointSpacing=65536 ) as inputFile:
+            for i in range( 60 ):
+                offset = int( rng.integers( 0, len( data ) ) )
+                size   = int( rng.integers( 1, 200000 ) )
+                inputFile.seek( offset )
+                assert inputFile.read( size ) == data[ offset:offset+size ], 'CompressedFile read the wrong data'
+    finally:
+        shutil.rmtree( workDir )
+    print( 'check_compressed_read ok' )
+
+def check_compressed_index():
+    """
+    A gzip file opened from the status cache should use the saved checkpoints, 
+    and read the same frames as the uncompressed file
+    """
+    workDir = tempfile.mkdtemp( prefix='lmaiotest' )
+    try:
+        path = os.path.join( workDir, 'raw.dat' )
+        synthetic.write_raw_file( path, 1685620800, nSeconds=60, triggerRate=4000, seed=2 )
+        with open( path, 'rb' ) as inputFile, gzip.open( path+'.gz', 'wb' ) as outputFile:
+            outputFile.write( inputFile.read() )
+        lmaFile = raw_io.RawLMAFile( path )
+        for i in range( 2 ):
+            gzFile = raw_io.RawLMAFile( path+'.gz', cache=True )
+            assert gzFile._indexCached == ( i == 1 ), 'the checkpoints were not saved in the status cache'
+            for iFrame in ( 40, 3, 59 ):
+                assert ( gzFile.read_frame( iFrame ).nano == lmaFile.read_frame( iFrame ).nano ).all(), 'the gzip file read the wrong frame'
+            gzFile.close()
+        lmaFile.close()
+
+        #small spacing, so there are checkpoints in the middle of the stream
+        with open( path, 'rb' ) as inputFile:
+            data = inputFile.read()
+        index = compressed.CompressedFile( path+'.gz', checkpointSpacing=65536 ).get_index()
+        assert ( index['bits'] != 0 ).any(), 'no checkpoints part way through a byte'
+        rng = np.random.default_rng( 0 )
+        with compressed.CompressedFile( path+'.gz', checkpointSpacing=65536, index=index ) as inputFile:
+            for i in range( 60 ):
+                offset = int( rng.integers( 0, len( data ) ) )
+                size   = int( rng.integers( 1, 200000 ) )
+                inputFile.seek( offset )
+                assert inputFile.read( size ) == data[ offset:offset+size ], 'CompressedFile read the wrong data from a saved index'
+    finally:
+        shutil.rmtree( workDir )
+    print( 'check_compressed_index ok' )
+
+def check_skipped_frame():
+    """
+    Junk in the middle of a frame should cost that frame, not the whole file
+    """
+    workDir = tempfile.mkdtemp( prefix='lmaiotest' )
+    try:
+        path = os.path.join( workDir, 'rt.dat' )
+        synthetic.write_raw_file( path, 1685620800, nSeconds=30, triggerRate=2000, decimateWindow=80000, seed=1 )
+        lmaFile = raw_io.RawLMAFile( path, decimated=True )
+        junkLocation = int( lmaFile.statusLocations[9] ) + lmaFile.statusSize + 600
+        nPeaks = [ len( frame.nano ) for frame in lmaFile.iter_frames() ]
+        lmaFile.close()
+        with open( path, 'rb' ) as inputFile:
+            data = inputFile.read()
+        with open( path, 'wb' ) as outputFile:
+            outputFile.write( data[:junkLocation] + b'\x01\x02\x03\x04\x05' + data[junkLocation:] )
+
+        with warnings.catch_warnings():
+            warnings.simplefilter( 'ignore' )
+            #the second time is from the cache
+            for i in range( 2 ):
+                lmaFile = raw_io.RawLMAFile( path, decimated=True, cache=True )
+                assert len( lmaFile.skippedRegions ) == 1, 'the junk was not found'
+                skipped = [ len( frame.nano ) for frame in lmaFile.iter_frames() ]
+                assert skipped == nPeaks[:9] + [0] + nPeaks[10:], 'only the frame with the junk should be empty'
+                lmaFile.close()
+    finally:
+        shutil.rmtree( workDir )
+    print( 'check_skipped_frame ok' )
+
+check_cache_poll()
+check_compressed_read()
+check_compressed_index()
+check_skipped_frame()
+
 #load in a whole bunch of raw data files
 inPaths = glob.glob( '/data/LMA/iop3/*120000.dat') 
-lmaFiles = []
-epoch = 0
-for inPath in inPaths:
-    lmaFile = raw_io.RawLMAFile( inPath )
-    lmaFiles.append( lmaFile )
-
-    #getting the startEpoch this way is a little dangerous 
-    #if all the files don't start at the same time
-    if lmaFile.startEpoch > epoch:
-        epoch = lmaFile.startEpoch
-
-epoch -=1
-frames = [0]
-for i in range( 601 ):
-    epoch += 1
+#the network reader lines up all the files by epoch
+networkReader = raw_io.NetworkReader( inPaths )
+
+for frames in networkReader:
     #collect frames from all LMA files related to current epoch
-    frames = []
     stations = []
-    for lmaFile in lmaFiles:
-
-        #the epoch we're looking for should be in the 
-        #frameEpochs table, hopefully
-        if epoch in lmaFile.frameEpochs:
-            #great, now we don't have to loop over all the statuses
-            iFrame = lmaFile.frameEpochs[epoch]
-            lmaFrame = lmaFile.read_frame( iFrame )
-            
-            #create station from frame information
-            stations.append( raw_io.Station( id=lmaFrame.id, geodetic=lmaFrame.geodetic, cartesian=lmaFrame.cartesian, delay=0) )
-            #decimate the frame
-            lmaFrame.decimate( 2000000 )
-
-            #append frame to list, for reasons
-            frames.append( lmaFrame )
-        #else, this epoch doesn't exist, boo
-
-    #all of the epochs should have 7 files, 
-    #except of the last one which has 0
+    for id, lmaFrame in frames.items():
+        epoch = lmaFrame.epoch
+        #create station from frame information
+        stations.append( raw_io.Station( id=lmaFrame.id, geodetic=lmaFrame.geodetic, cartesian=lmaFrame.cartesian, delay=0) )
+        #decimate the frame
+        lmaFrame.decimate( 2000000 )
+
+    #all of the epochs should have 7 files
     print ('Read %i frames for epoch %i'%(len(frames), epoch) )
 
     #we should be able to create a locFile from these frames
@@ -55,3 +156,4 @@ for i in range( 601 ):
     locFile = raw_io.LocFile()
     for station in stations:
         locFile.add( station )
+networkReader.close()
@@ -0,0 +1,306 @@
+import raw_io, synthetic, phasor
+import os, sys, time, argparse
+import numpy as np
+from scipy import optimize
+#TODO - change to relative imports
+from common import *
+from constants import *
+
+"""
+Simulated lightning for a whole LMA network, and a benchmark of the location
+pipeline on it
+
+Sources are scattered in space and time over the network.  The arrival time
+of each source at each station comes from a propagation model (the same ones
+Phasor uses), plus the station delay, plus RmsTiming of gaussian noise.  Noise
+triggers are added, and each station keeps only the biggest peak in each 80us
+window, like the real thing.  This gives a dict of LMAFrames for each second,
+or raw data files for each station.
+
+The benchmark runs Phasor -> Solution -> solver on the frames, the same way
+phasor_test does, and since we know where the sources really were, it also
+reports how many of them were found.
+
+Usage: python network_sim.py [--seconds 5] [--rate 100000] [--write outputDir]
+"""
+
+#the simulated sources
+sourceDtype = [ ('time','i8'),      #ns after the start of the simulation
+                ('lat','f8'), ('lon','f8'), ('alt','f8'),
+                ('x','f8'), ('y','f8'), ('z','f8'),
+                ('power','f4') ]    #dBm, received 1km away
+
+def make_sources( rng, nSources, nSeconds, center, radius=10000., altitudes=(2000., 15000.) ):
+    """
+    Sources uniformly scattered in time, and in a cylinder around center
+
+    nSources  - how many sources
+    nSeconds  - the sources happen in the first nSeconds
+    center    - (lat, lon, alt) of the middle of the cylinder, the alt isn't used
+    radius    - of the cylinder, in meters
+    altitudes - bottom and top of the cylinder, in meters
+
+    returns structured array with sourceDtype, in time order
+    """
+    sources = np.zeros( nSources, dtype=sourceDtype )
+    sources['time'] = np.sort( rng.integers( 0, nSeconds*1000000000, nSources ) )
+    #uniform over the disk
+    r     = radius*np.sqrt( rng.uniform( size=nSources ) )
+    theta = rng.uniform( 0, 2*np.pi, nSources )
+    sources['lat'] = center[0] + r*np.cos( theta )/Earc
+    sources['lon'] = center[1] + r*np.sin( theta )/( Earc*np.cos( center[0]*np.pi/180 ) )
+    sources['alt'] = rng.uniform( altitudes[0], altitudes[1], nSources )
+    #latlonalt2xyz changes it's arguments, so give it copies
+    x, y, z = latlonalt2xyz( sources['lat'].copy(), sources['lon'].copy(), sources['alt'].copy() )
+    sources['x'], sources['y'], sources['z'] = x, y, z
+    #mostly weak, with a tail of big ones
+    sources['power'] = -55 + rng.exponential( 8.0, nSources )
+    return sources
+
+def arrival_times( sources, station, propagationModel=phasor.euclidean_propagation ):
+    """
+    When each source gets to station (ns after the start of the simulation, no noise)
+    """
+    source = raw_io.Station()
+    dt = np.empty( len( sources ) )
+    for i in range( len( sources ) ):
+        #the propagation models want objects with locations
+        source.cartesian = sources['x'][i], sources['y'][i], sources['z'][i]
+        dt[i] = propagationModel( source, station )
+    return sources['time'] + dt + ( station.delay or 0 )
+
+def simulate_network( locFile, sources, startEpoch, nSeconds, seed=None, noiseRate=500, rmsTiming=RmsTiming,
+                      threshold=-95., windowLength=80000, propagationModel=phasor.euclidean_propagation ):
+    """
+    What each station in locFile would record for sources
+
+    sources    - structured array with sourceDtype (see make_sources)
+    startEpoch - the epoch of the first second, source time 0 is the start of it
+    nSeconds   - number of seconds (frames) to make
+    noiseRate  - average number of noise triggers per second, at each station
+    rmsTiming  - ns of timing noise
+    threshold  - peaks weaker than this (dBm) aren't recorded
+
+    returns frames, labels
+        frames - {epoch:{id:LMAFrame}}, what the NetworkReader.iter_epochs would give
+        labels - {epoch:{id:array}}, the source (index into sources) for each
+                 peak in the frame, -1 for noise triggers
+    """
+    rng = np.random.default_rng( seed )
+    frames = { startEpoch+i:{} for i in range( nSeconds ) }
+    labels = { startEpoch+i:{} for i in range( nSeconds ) }
+    for id, station in sorted( locFile.sensors.items() ):
+        arrivals = arrival_times( sources, station, propagationModel )
+        arrivals = np.round( arrivals + rng.normal( 0, rmsTiming, len( arrivals ) ) ).astype( 'i8' )
+        D = np.sqrt( ( sources['x']-station.cartesian[0] )**2 + ( sources['y']-station.cartesian[1] )**2 +
+                     ( sources['z']-station.cartesian[2] )**2 )
+        power = sources['power'] - 20*np.log10( D/1000 )
+        seen  = power >= threshold
+        second = arrivals//1000000000
+
+        for i in range( nSeconds ):
+            epoch = startEpoch+i
+            inSecond = seen & ( second == i )
+            noiseNano, noisePower, noiseAbove = synthetic.random_peaks( rng, noiseRate, windowLength )
+            nano  = np.concatenate( [ arrivals[ inSecond ]%1000000000, noiseNano ] )
+            peakPower   = np.concatenate( [ power[ inSecond ], noisePower ] )
+            aboveThresh = np.concatenate( [ 1+rng.geometric( 0.1, inSecond.sum() ), noiseAbove ] )
+            label = np.concatenate( [ np.flatnonzero( inSecond ), np.full( len( noiseNano ), -1 ) ] )
+            triggerCount = len( nano )
+            #peaks are in time order in the real thing
+            order = np.argsort( nano, kind='stable' )
+            nano, peakPower, aboveThresh, label = nano[ order ], peakPower[ order ], aboveThresh[ order ], label[ order ]
+
+            #the biggest peak in each window, decimate_peaks gives back the indices
+            #if we hand it an arange instead of aboveThresh
+            nano, peakPower, keep = synthetic.decimate_peaks( nano, peakPower, np.arange( len( nano ) ), windowLength )
+
+            statusPacket = raw_io.StatusPacket( synthetic.encode_status_packets( 12, [epoch], [triggerCount], id=id,
+                                                                                 netid='A' )[0].tobytes() )
+            statusPacket.geodetic  = station.geodetic
+            statusPacket.cartesian = station.cartesian
+            columns = { 'nano':nano.astype( 'i4' ), 'power':peakPower.astype( 'f4' ),
+                        'aboveThresh':np.minimum( aboveThresh[ keep ], 0xffff ).astype( 'u2' ) }
+            frames[ epoch ][ id ] = raw_io.LMAFrame( statusPacket, columns=columns )
+            labels[ epoch ][ id ] = label[ keep ]
+    return frames, labels
+
+def write_network_files( outputDir, frames, startEpoch, nSeconds, version=12 ):
+    """
+    Write frames (from simulate_network) to a raw data file for each station
+    These are regular files, NetworkReader can read them.  The times get
+    rounded to the data packet clock ticks (tens of ns) on the way
+
+    returns list of paths
+    """
+    if not os.path.exists( outputDir ):
+        os.makedirs( outputDir )
+    ids = sorted( set( id for epochFrames in frames.values() for id in epochFrames ) )
+    outputPaths = []
+    for id in ids:
+        peaks = {}
+        for epoch, epochFrames in frames.items():
+            if id in epochFrames:
+                frame = epochFrames[ id ]
+                peaks[ epoch ] = frame.nano, frame.power, frame.aboveThresh
+                geodetic = frame.geodetic
+        outputPath = os.path.join( outputDir, 'sim_%s.dat'%id )
+        #the file starts with the status packet for the second before the first frame
+        synthetic.write_raw_file( outputPath, startEpoch-1, nSeconds=nSeconds, version=version, id=id,
+                                  geodetic=geodetic, peaks=peaks )
+        outputPaths.append( outputPath )
+    return outputPaths
+
+def toa_resid( x, data ):
+    """
+    x    - source time and location (nano, x, y, z)
+    data - array of peaks (arrival nano, x, y, z)
+    """
+    D = np.sqrt( ( ( data[:,1:]-x[1:] )**2 ).sum( axis=1 ) )
+    return x[0] + D/Cns - data[:,0]
+
+def toa_jacobian( x, data ):
+    """
+    Derivatives of toa_resid, so the solver doesn't have to work them out numerically
+    """
+    dx = x[1:]-data[:,1:]
+    D  = np.sqrt( ( dx**2 ).sum( axis=1 ) )
+    return np.column_stack( [ np.ones( len( data ) ), dx/( D[:,None]*Cns ) ] )
+
+def solve( solution, startAlt=7000. ):
+    """
+    Find the source location for a solution with the time of arrival solver
+    The solver starts at startAlt above the phase center, starting on the
+    ground can find the mirror image solution underground
+
+    returns success, (nano, x, y, z), rms residual in ns
+    """
+    cartesian, delay = solution.loc.sensor_table()
+    sensor = solution.selectedPeaks['sensor']
+    data = np.column_stack( [ solution.selectedPeaks['arrival'] - delay[ sensor ], cartesian[ sensor ] ] )
+    lat, lon, alt = solution.geodetic if solution.geodetic is not None else xyz2latlonalt( *solution.cartesian )
+    x0 = np.array( [ solution.nano ] + list( latlonalt2xyz( lat, lon, startAlt ) ), dtype='f8' )
+    sol = optimize.root( toa_resid, x0, args=(data,), jac=toa_jacobian, method='lm' )
+    r = toa_resid( sol.x, data )
+    return sol.success, sol.x, np.sqrt( ( r**2 ).mean() )
+
+def run_pipeline( frames, labels, sources, locFile, windowLength=80000, tolerance=1000., maxResid=1000., startAlt=7000., centers=None ):
+    """
+    Phasor -> Solution -> solver on each second of frames, timing each step
+
+    centers   - phase centers for a MultiPhasor, otherwise a Phasor at the network center is used
+    tolerance - a source is found if a solution is within this many meters of it
+    maxResid  - solutions with rms residuals worse than this (ns) are thrown out
+
+    returns dict of counts and times
+    """
+    cartesian = locFile.network.cartesian
+    geodetic  = locFile.network.geodetic
+    stats = { 'guesses':0, 'solutions':0, 'solved':0, 'phasorTime':0., 'solutionTime':0., 'solverTime':0. }
+    found = set()
+    for epoch in sorted( frames ):
+        tStart = time.perf_counter()
+        if centers is None:
+            p = phasor.Phasor( frames[ epoch ], locFile=locFile, cartesian=cartesian, geodetic=geodetic, windowLength=windowLength )
+        else:
+            p = phasor.MultiPhasor( frames[ epoch ], centers, locFile=locFile, windowLength=windowLength )
+        stats['phasorTime'] += time.perf_counter() - tStart
+        stats['guesses'] += len( p.guesses )
+
+        tStart = time.perf_counter()
+        solutions = []
+        if centers is None:
+            for start, stop in p.guesses:
+                peaks = p.sortedPeaks[ start:stop ]
+                solutions.append( phasor.Solution( peaks, np.median( peaks['time'] ), phasor=p ) )
+        else:
+            solutions = [ p.solution( i ) for i in range( len( p.guesses ) ) ]
+        solutions.sort()
+        stats['solutionTime'] += time.perf_counter() - tStart
+        stats['solutions'] += len( solutions )
+
+        tStart = time.perf_counter()
+        located = []
+        for s in solutions:
+            success, x, r = solve( s, startAlt )
+            if success and r < maxResid:
+                located.append( ( s, x ) )
+        stats['solverTime'] += time.perf_counter() - tStart
+        stats['solved'] += len( located )
+
+        #which source was each solution looking at?  the one most of it's peaks came from
+        for s, x in located:
+            sourceIds = []
+            for pk in s.selectedPeaks:
+                id = chr( pk['sensor'] )
+                frameNano = frames[ epoch ][ id ].nano
+                i = np.searchsorted( frameNano, pk['arrival'] )
+                if i < len( frameNano ) and frameNano[i] == pk['arrival']:
+                    sourceIds.append( labels[ epoch ][ id ][i] )
+            sourceIds = [ i for i in sourceIds if i >= 0 ]
+            if not sourceIds:
+                continue
+            iSource = np.bincount( sourceIds ).argmax()
+            source  = sources[ iSource ]
+            if distance.euclidean( x[1:], ( source['x'], source['y'], source['z'] ) ) < tolerance:
+                found.add( int( iSource ) )
+    stats['found'] = len( found )
+    return stats
+
+def detectable( labels, nSources, minSensors=5 ):
+    """
+    Number of sources that made it through to more than minSensors stations
+    """
+    counts = np.zeros( nSources, dtype='i8' )
+    for epochLabels in labels.values():
+        for label in epochLabels.values():
+            counts += np.bincount( label[ label >= 0 ], minlength=nSources )
+    return int( ( counts > minSensors ).sum() )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Benchmark the location pipeline on a simulated network' )
+    parser.add_argument( '--seconds', type=int, default=5, help='seconds of data to simulate' )
+    parser.add_argument( '--rate', type=float, default=100000, help='sources per minute' )
+    parser.add_argument( '--stations', type=int, default=10, help='number of stations' )
+    parser.add_argument( '--radius', type=float, default=50000, help='stations are within this many meters of the center' )
+    parser.add_argument( '--source-radius', type=float, default=10000, help='sources are within this many meters of the center' )
+    parser.add_argument( '--noise', type=float, default=500, help='noise triggers per second at each station' )
+    parser.add_argument( '--window', type=int, default=80000, help='Phasor windowLength, ns' )
+    parser.add_argument( '--grid', type=float, help='use a MultiPhasor with phase centers this many meters apart over the sources' )
+    parser.add_argument( '--tolerance', type=float, default=1000, help='meters, for a source to count as found' )
+    parser.add_argument( '--write', help='also write raw data files for each station to this directory' )
+    parser.add_argument( '--seed', type=int, default=0 )
+    args = parser.parse_args()
+
+    startEpoch = 1685620800     #2023-06-01
+    rng = np.random.default_rng( args.seed )
+    locFile = synthetic.make_loc_file( nStations=args.stations, radius=args.radius, seed=args.seed )
+    nSources = int( args.rate*args.seconds/60 )
+
+    tStart  = time.perf_counter()
+    sources = make_sources( rng, nSources, args.seconds, locFile.network.geodetic, radius=args.source_radius )
+    frames, labels = simulate_network( locFile, sources, startEpoch, args.seconds, seed=args.seed, noiseRate=args.noise )
+    print( 'simulated %i sources, %i stations, %i seconds in %.2f s'%( nSources, args.stations, args.seconds, time.perf_counter()-tStart ) )
+    if args.write:
+        for outputPath in write_network_files( args.write, frames, startEpoch, args.seconds ):
+            print( 'wrote', outputPath )
+
+    centers = None
+    if args.grid:
+        centers = phasor.center_grid( locFile.network.geodetic, args.source_radius, args.grid )
+        print( 'MultiPhasor with %i phase centers'%len( centers ) )
+    stats = run_pipeline( frames, labels, sources, locFile, windowLength=args.window, tolerance=args.tolerance, centers=centers )
+    totalTime = stats['phasorTime'] + stats['solutionTime'] + stats['solverTime']
+    nDetectable = detectable( labels, nSources )
+
+    print( '%-12s %9.3f s'%( 'Phasor', stats['phasorTime'] ) )
+    print( '%-12s %9.3f s'%( 'Solution', stats['solutionTime'] ) )
+    print( '%-12s %9.3f s'%( 'solver', stats['solverTime'] ) )
+    print( '%-12s %9.3f s'%( 'total', totalTime ) )
+    print( 'guesses      %9i  %12.0f guesses/s'%( stats['guesses'], stats['guesses']/totalTime ) )
+    print( 'sources      %9i  %12.0f sources/s'%( nSources, nSources/totalTime ) )
+    print( 'solved       %9i'%stats['solved'] )
+    print( 'found        %9i  %5.1f%% of all sources, %5.1f%% of the %i seen by >5 stations'%(
+            stats['found'], 100.*stats['found']/max( nSources, 1 ), 100.*stats['found']/max( nDetectable, 1 ), nDetectable ) )
+    #how much faster than real time this is
+    print( 'real time factor %.2f (>1 keeps up with %i sources/minute)'%( args.seconds/totalTime, args.rate ) )
@@ -19,9 +19,72 @@ def euclidean_propagation( ob1, ob2 ):
     Calculates the expected light propagation time difference 
     in nanoseconds between two objects, using their cartesian 
     locations
+
+    The cartesian locations can also be arrays, with x,y,z in the last 
+    dimension.  These broadcast against each other, so a (M,1,3) array of 
+    targets and a (N,3) array of sensors gives (M,N) times
     """
-    D = distance.euclidean( ob1.cartesian, ob2.cartesian )
+    if isinstance( ob1.cartesian, np.ndarray ) or isinstance( ob2.cartesian, np.ndarray ):
+        D = np.sqrt( ( ( np.asarray( ob1.cartesian ) - np.asarray( ob2.cartesian ) )**2 ).sum( axis=-1 ) )
+    else:
+        D = distance.euclidean( ob1.cartesian, ob2.cartesian )
     return D/Cns
+#models that take arrays of locations can be used on a whole Solution at once
+euclidean_propagation.vectorized = True
+
+#the phased peaks
+peakDtype = [ ('time','i8'),        #source time, if the source was at the phase center
+              ('sensor','u1'),      #ord of the sensor id
+              ('arrival','i8'),     #arrival time at the sensor
+              ('power','f4') ]
+
+def find_guesses( sourceTime, sensor, windowLength, minSensors ):
+    """
+    Looks over sorted source times for windows with more than minSensors sensors in them
+
+    returns guesses, nSensors
+        guesses  - (start, stop) pairs of indices for each window
+        nSensors - the number of sensors in each window
+    """
+    L = len( sourceTime )
+
+    #the window for each peak goes up to the first peak windowLength after it
+    #and always includes at least the next peak
+    iPeak = np.arange( L )
+    stop  = np.maximum( np.searchsorted( sourceTime, sourceTime+windowLength ), np.minimum( iPeak+1, L ) )
+    start = np.flatnonzero( stop-iPeak > minSensors )
+    stop  = stop[ start ]
+
+    #count sensors, using how many peaks each sensor has before each index
+    nSensors = np.zeros( len( start ), dtype='i8' )
+    for s in np.unique( sensor ):
+        count = np.concatenate( [[0], np.cumsum( sensor == s, dtype='i4' )] )
+        nSensors += count[ stop ] > count[ start ]
+    enough = nSensors > minSensors
+    start, stop, nSensors = start[ enough ], stop[ enough ], nSensors[ enough ]
+
+    #a guess has to reach past the end of the last guess.  The windows only
+    #get longer, so the last guess ends where the candidate before this one does
+    keep = np.diff( stop, prepend=0 ) > 0
+    return np.column_stack( [start[ keep ], stop[ keep ]] ), nSensors[ keep ]
+
+def center_grid( geodetic, radius, spacing, altitudes=(0.,) ):
+    """
+    Phase centers on a grid around geodetic, for MultiPhasor
+
+    geodetic  - (lat, lon, alt) middle of the grid
+    radius    - the grid goes this many meters out from the middle (a circle)
+    spacing   - meters between centers
+    altitudes - the grid is repeated at each of these altitudes
+
+    returns cartesian centers, 1 per row
+    """
+    steps = np.arange( -( radius//spacing ), radius//spacing+1 )*spacing
+    dx, dy, alt = np.meshgrid( steps, steps, altitudes, indexing='ij' )
+    inside = dx**2 + dy**2 <= radius**2
+    lat = geodetic[0] + dy[ inside ]/Earc
+    lon = geodetic[1] + dx[ inside ]/( Earc*np.cos( geodetic[0]*np.pi/180 ) )
+    return np.column_stack( latlonalt2xyz( lat, lon, alt[ inside ].astype( 'f8' ) ) )
 
 class Phasor( ):
 
@@ -93,63 +156,200 @@ class Phasor( ):
         Applies these delays to the raw data, and adds all data into sorted array
         """
 
-        self.sortedPeaks = np.empty( [0,4], dtype='i' )
+        #each frame is already in time order, and the shift is the same for all of a
+        #sensor's peaks, so the source times are made of presorted runs, 1 per sensor.
+        #the stable sort (timsort) finds the runs and merges them
+        #the columns are kept separate until they're in order, moving whole records 
+        #around is a lot slower than moving the columns one at a time
+        M = [ len( self.frames[id].nano ) for id in self.sensorIds ]
+        columns = { name:np.empty( sum( M ), dtype=dtype ) for name, dtype in peakDtype }
 
+        N = 0
         for i in range( len( self.sensorIds) ):
             id = self.sensorIds[i]
+            frame = self.frames[id]
             #calculate the propagation time
-            dt = self.propagationModel( self, self.frames[id] )
+            dt = self.propagationModel( self, frame )
 
-            #extend the sortedPeaks array
-            N = len( self.sortedPeaks )
-            M = len( self.frames[id].nano )
-            self.sortedPeaks.resize( [N+M,4] )
             #source time
-            self.sortedPeaks[N:,0] = self.frames[id].nano-dt
+            columns['time'][N:N+M[i]] = frame.nano-dt
             #sensor ID - encode as int for easier cython schenanegans 
-            self.sortedPeaks[N:,1] = ord( id )
+            columns['sensor'][N:N+M[i]] = ord( id )
             #arrival time
-            self.sortedPeaks[N:,2] = self.frames[id].nano
+            columns['arrival'][N:N+M[i]] = frame.nano
             #power
-            self.sortedPeaks[N:,3] = self.frames[id].power.astype('i')
+            columns['power'][N:N+M[i]] = frame.power
+            N += M[i]
         
-        #there should be a better way to do this in-place, but for now this will work
-        i = self.sortedPeaks[:,0].argsort()
-        self.sortedPeaks = self.sortedPeaks[i]
+        order = columns['time'].argsort( kind='stable' )
+        self.sortedPeaks = np.empty( N, dtype=peakDtype )
+        for name in columns:
+            self.sortedPeaks[ name ] = columns[ name ][ order ]
 
     def find_initial_guesses(self):
         """
         find_initial_guesses
 
-        loops over sorted array looking for possible locations
-        """
-        self.guesses = []
-        lastGuess = 0
-        iGuess = 0
-        while iGuess < len(self.sortedPeaks)-self.minSensors :
-            n = 1
-            while self.sortedPeaks[iGuess+n,0]-self.sortedPeaks[iGuess,0] < self.windowLength:
-                n += 1
-                if iGuess+n >= len( self.sortedPeaks ):
-                    #we're trying to walk off the end of the array
-                    break
-            if n > self.minSensors and iGuess+n > lastGuess:
-                #count sensors
-                sensors = set()
-                guess = np.arange( iGuess, iGuess+n )
-                for i in guess:
-                    sensors.add( self.sortedPeaks[i,1] )
-                if len(sensors) > self.minSensors:
-                    self.guesses.append( guess )
-                    lastGuess = iGuess+n
-                    iGuess = iGuess+1
-                else:
-                    iGuess += 1
-            else:
-                iGuess += 1
+        looks over sorted array for windows with enough sensors in them
+        each guess is a (start, stop) pair of indices into sortedPeaks
+        """
+        self.guesses, self.guessSensors = find_guesses( self.sortedPeaks['time'], self.sortedPeaks['sensor'], 
+                                                        self.windowLength, self.minSensors )
+
+class MultiPhasor( Phasor ):
+
+    def __init__( self, frames, centers, locFile=None, propagationModel=euclidean_propagation, windowLength=80000, minSensors=5 ):
+        """
+        A Phasor with lots of phase centers, so sources far from the network 
+        center don't get missed
+
+        frames  -   dict of LMAFrames of data
+        centers -   array of phase centers (cartesian), 1 per row.  See center_grid
+        """
+        self.centers = np.atleast_2d( np.asarray( centers, dtype='f8' ) )
+        Phasor.__init__( self, frames, locFile=locFile, propagationModel=propagationModel, 
+                         windowLength=windowLength, minSensors=minSensors )
+
+    def phase_raw_data( self ):
+        """
+        phase_raw_data
+
+        Calculates the delay between each sensor and each phase center.  The data 
+        is sorted for 1 center at a time (see center_order), so the memory used 
+        doesn't go up with the number of centers
+        self.peaks       - all the peaks, sensor by sensor.  The time is the arrival time
+        self.delays      - [center, sensor] propagation times, sensor is the index in sensorIds
+        self.sensorIndex - which column of delays goes with each peak
+        """
+        #the delay matrix, the propagation models want objects with locations
+        if getattr( self.propagationModel, 'vectorized', False ):
+            sensorCartesian = np.array( [ self.frames[id].cartesian for id in self.sensorIds ], dtype='f8' ).reshape( -1, 3 )
+            self.delays = self.propagationModel( raw_io.Station( cartesian=self.centers[:,None,:] ), 
+                                                 raw_io.Station( cartesian=sensorCartesian ) )
+        else:
+            center = raw_io.Station()
+            self.delays = np.empty( [len( self.centers ), len( self.sensorIds )] )
+            for i in range( len( self.centers ) ):
+                center.cartesian = tuple( self.centers[i] )
+                for j in range( len( self.sensorIds ) ):
+                    self.delays[i,j] = self.propagationModel( center, self.frames[ self.sensorIds[j] ] )
+
+        M = [ len( self.frames[id].nano ) for id in self.sensorIds ]
+        self.peaks = np.empty( sum( M ), dtype=peakDtype )
+        self.sensorIndex = np.repeat( np.arange( len( self.sensorIds ) ), M )
+        N = 0
+        for i in range( len( self.sensorIds ) ):
+            frame = self.frames[ self.sensorIds[i] ]
+            self.peaks['time'][N:N+M[i]]    = frame.nano
+            self.peaks['sensor'][N:N+M[i]]  = ord( self.sensorIds[i] )
+            self.peaks['arrival'][N:N+M[i]] = frame.nano
+            self.peaks['power'][N:N+M[i]]   = frame.power
+            N += M[i]
+        #the last center sorted, see center_order
+        self._centerOrder = None
+
+    def center_order( self, center ):
+        """
+        The source times for a phase center, and the order that sorts them
+
+        returns sortedTimes, order
+            sortedTimes - source times in order, this is Phasor.sortedPeaks['time']
+            order       - puts self.peaks in source time order for this center
+
+        Only the last center is kept.  The guesses are in center order, so going 
+        through them in order only sorts each center once
+        """
+        if self._centerOrder is None or self._centerOrder[0] != center:
+            #each sensor's peaks are in order already, like in Phasor
+            sourceTime = ( self.peaks['arrival'] - self.delays[ center, self.sensorIndex ] ).astype( 'i8' )
+            order = sourceTime.argsort( kind='stable' )
+            self._centerOrder = center, sourceTime[ order ], order
+        return self._centerOrder[1:]
+
+    def find_initial_guesses( self ):
+        """
+        find_initial_guesses
+
+        finds the guesses for each center
+        self.guesses      - (start, stop) pairs of indices into the center's order (see center_order)
+        self.guessCenters - which center each guess is for
+
+        The same source is usually found by the centers around it.  Guesses whose 
+        biggest peak is the same peak are the same source, and only the center 
+        with the most sensors on it (then the first center) keeps it's guesses for 
+        that peak.  A center on it's own has the same guesses as a Phasor there
+        """
+        L = len( self.peaks )
+        #rank the peaks by power (ties go to the first one), so the biggest peak 
+        #in each window is the one with the highest rank.  No 2 peaks have the 
+        #same rank, so the rank says which peak it is
+        rank = np.empty( L, dtype='i8' )
+        rank[ np.lexsort( ( -np.arange( L ), self.peaks['power'] ) ) ] = np.arange( L )
+
+        guesses, guessSensors, guessCenters, biggest = [], [], [], []
+        for i in range( len( self.centers ) ):
+            sortedTimes, order = self.center_order( i )
+            g, n = find_guesses( sortedTimes, self.peaks['sensor'][ order ], self.windowLength, self.minSensors )
+            guesses.append( g )
+            guessSensors.append( n )
+            guessCenters.append( np.full( len( g ), i ) )
+            if len( g ) == 0:
+                biggest.append( np.empty( 0, dtype='i8' ) )
+                continue
+
+            #the max rank in each window, with 1 reduceat.  The starts and stops go 
+            #one after the other, so the even results are the max over [start, stop).  
+            #That needs start < stop, which find_guesses always gives.  The odd results 
+            #are from a stop to the next start, and get thrown away
+            bounds = g.ravel()
+            #the last stop can be the end of the row, which isn't a valid index for 
+            #reduceat.  An extra element gives it something to land on
+            sortedRank = np.append( rank[ order ], 0 )
+            windowMax  = np.maximum.reduceat( sortedRank, bounds )
+            biggest.append( windowMax[::2] )
+        guesses      = np.concatenate( guesses ) if guesses else np.empty( [0,2], dtype='i8' )
+        guessSensors = np.concatenate( guessSensors ) if guessSensors else np.empty( 0, dtype='i8' )
+        guessCenters = np.concatenate( guessCenters ) if guessCenters else np.empty( 0, dtype='i8' )
+        biggest      = np.concatenate( biggest ) if biggest else np.empty( 0, dtype='i8' )
+
+        #group the guesses by biggest peak, most sensors first, then the first center
+        iGuess = np.lexsort( ( np.arange( len( guesses ) ), -guessSensors, biggest ) )
+        #the first guess in each group says which center gets the peak
+        first  = np.concatenate( [[True], biggest[ iGuess ][1:] != biggest[ iGuess ][:-1]] )[:len( iGuess )]
+        group  = np.cumsum( first )-1
+        winner = guessCenters[ iGuess[ first ] ]
+        #the guesses are in center order, sorting keeps them that way
+        keep   = np.sort( iGuess[ guessCenters[ iGuess ] == winner[ group ] ] )
+
+        self.guesses      = guesses[ keep ]
+        self.guessSensors = guessSensors[ keep ]
+        self.guessCenters = guessCenters[ keep ]
+
+    def guess_peaks( self, iGuess ):
+        """
+        The peaks for guess iGuess, with source times for it's center
+        This is the same as Phasor.sortedPeaks[ start:stop ]
+        """
+        start, stop = self.guesses[ iGuess ]
+        sortedTimes, order = self.center_order( self.guessCenters[ iGuess ] )
+        peaks = self.peaks[ order[ start:stop ] ]
+        peaks['time'] = sortedTimes[ start:stop ]
+        return peaks
+
+    def solution( self, iGuess ):
+        """
+        Make a Solution for guess iGuess, starting from it's center
+        """
+        peaks = self.guess_peaks( iGuess )
+        cartesian = tuple( self.centers[ self.guessCenters[ iGuess ] ] )
+        return Solution( peaks, np.median( peaks['time'] ), loc=self.loc, propagationModel=self.propagationModel,
+                         geodetic=xyz2latlonalt( *cartesian ), cartesian=cartesian )
 
 class Solution():
-    def __init__(self, peaks, nano=0, loc=None, propagationModel=None, geodetic=None, cartesian=None, phasor=None ):
+    def __init__(self, peaks, nano=0, loc=None, propagationModel=None, geodetic=None, cartesian=None, phasor=None, nearest=False, topN=1 ):
+        """
+        nearest, topN - how the peaks are picked, see select_peaks
+        """
         self.peaks     = peaks
         self.nano      = nano
         if phasor != None:
@@ -166,7 +366,7 @@ class Solution():
             self.geodetic  = geodetic
             self.cartesian = cartesian
 
-        self.select_peaks()
+        self.select_peaks( nearest=nearest, topN=topN )
         self.update()
 
     def update(self):
@@ -179,24 +379,43 @@ class Solution():
         # self.quality = len(self.selectedPeaks)
         self.quality = self.calc_quality()
 
-    def calc_residual( self, target=None ):
+    def calc_residual( self, target=None, nano=None ):
         """
         the target here is the location you're testing.  to use the propagation model right 
         now that's supposed to be an object with cartesian or geodetic attributes
         which sounds a lot like a 'Station' object
+
+        target can also be a (M,3) array of cartesian locations, to test a batch of 
+        them at once.  nano is then a (M,) array of source times, and the residual 
+        is (M,N) for the N selectedPeaks.  This needs a vectorized propagationModel
         """
         #if we're not passed a target, calculate the residual for where 
         #we think the solution is now.  
-        if target == None: target = self
+        if target is None: target = self
+        if nano is None: nano = self.nano
+        batch = isinstance( target, np.ndarray )
+
+        if getattr( self.propagationModel, 'vectorized', False ):
+            #all the peaks at once, with the sensor locations from the loc file's table
+            cartesian, delay = self.loc.sensor_table()
+            sensorCartesian = cartesian[ self.selectedPeaks['sensor'] ]
+            if np.isnan( sensorCartesian ).any():
+                raise Exception( 'Solution.calc_residual - sensor missing from the loc file' )
+            if batch:
+                target = raw_io.Station( cartesian=target[:,None,:] )
+                nano   = np.asarray( nano )[:,None]
+            dt = self.propagationModel( target, raw_io.Station( cartesian=sensorCartesian ) )
+            return self.selectedPeaks['arrival'] - dt - nano
+        if batch:
+            raise Exception( 'Solution.calc_residual - a batch of targets needs a vectorized propagationModel' )
 
         #loop over peaks and apply the propagationModel to each
-        resid = []
         resid = np.zeros( len( self.selectedPeaks) )
         i = 0
         for peak in self.selectedPeaks:
             #ugh, I need to convert the numerical id to a ascii id for this
-            id = chr( peak[1] )
-            dt = peak[2] - self.propagationModel( target, self.loc.sensors[id] ) - self.nano
+            id = chr( peak['sensor'] )
+            dt = peak['arrival'] - self.propagationModel( target, self.loc.sensors[id] ) - nano
             resid[i] = dt
             i += 1
         
@@ -216,26 +435,38 @@ class Solution():
         return len( self.selectedPeaks ) / r5 * RmsTiming
     
 
-    def select_peaks(self, nearest=False):
+    def select_peaks(self, nearest=False, topN=1):
+        """
+        picks the peaks used for the solution, the biggest peak from each sensor
+
+        nearest - instead of the biggest, use the peak nearest the median source time
+        topN    - use up to this many peaks from each sensor, best first
+
+        the first peak is always used, and it's sensor doesn't get any others
+        the sensors are in the order they first show up in peaks
+        """
+        sensor = self.peaks['sensor']
         #we always include the first peak
-        selectedPeaks = [ self.peaks[0] ]
-        selectedSensors = {self.peaks[0][1]}
-        for i in range( 1, len( self.peaks) ):
-            #use each sensor once
-            if self.peaks[i][1] in selectedSensors: continue
-            #find 'best' peak for this sensor
-            bestPeak = self.peaks[i]
-            for j in range( i+1, len( self.peaks) ):
-                #not the same sensor
-                if self.peaks[j][1] != bestPeak[1]: continue
-                if self.peaks[j][3] > bestPeak[3]:
-                    bestPeak = self.peaks[j]
-            
-            #we've found the best peak, might be the same one we started with
-            #add it to the list
-            selectedPeaks.append( bestPeak )
-            selectedSensors.add( bestPeak[1] )  #this is a set, so we don't use 2 of the same sensor
-        self.selectedPeaks = np.array( selectedPeaks )
+        rest = np.flatnonzero( sensor != sensor[0] )
+        if nearest:
+            score = np.abs( self.peaks['time'][ rest ] - np.median( self.peaks['time'] ) )
+        else:
+            score = -self.peaks['power'][ rest ]
+
+        #group by sensor, best first in each group, and the first peak wins ties
+        order = rest[ np.lexsort( ( rest, score, sensor[ rest ] ) ) ]
+        if len( order ) == 0:
+            self.selectedPeaks = self.peaks[:1].copy()
+            return
+        groupStart = np.flatnonzero( np.concatenate( [[True], sensor[ order ][1:] != sensor[ order ][:-1]] ) )
+        groupSize  = np.diff( np.append( groupStart, len( order ) ) )
+        rank       = np.arange( len( order ) ) - np.repeat( groupStart, groupSize )
+        #where each sensor first shows up, which sets the order of the sensors
+        firstPeak  = np.repeat( np.minimum.reduceat( order, groupStart ), groupSize )
+
+        keep  = rank < topN
+        order = order[ keep ][ np.lexsort( ( rank[ keep ], firstPeak[ keep ] ) ) ]
+        self.selectedPeaks = self.peaks[ np.concatenate( [[0], order] ) ]
 
     def __lt__( self, other ):
         """
@@ -1,5 +1,6 @@
 import raw_io
 import phasor
+import synthetic, network_sim
 import glob
 import numpy as np
 from common import *
@@ -12,6 +13,45 @@ Also, I keep tearing it to the ground, and re-writing it.
 -- this may not function in environments other than my own
 """
 
+###
+# checks that make their own data, these work anywhere
+def check_multi_phasor():
+    """
+    A MultiPhasor with 1 center should find the same guesses as a Phasor there, 
+    and with lots of centers the guesses for each biggest peak should only come 
+    from 1 center
+    """
+    rng = np.random.default_rng( 0 )
+    locFile = synthetic.make_loc_file( nStations=10, radius=50000, seed=0 )
+    sources = network_sim.make_sources( rng, 2000, 1, locFile.network.geodetic )
+    frames, labels = network_sim.simulate_network( locFile, sources, 1685620800, 1, seed=0 )
+    frames  = frames[ 1685620800 ]
+    centers = phasor.center_grid( locFile.network.geodetic, 10000, 5000, altitudes=(0., 10000.) )
+
+    #the biggest peak in a guess, (sensor, arrival) says which peak it is
+    def biggest_peak( peaks ):
+        i = peaks['power'].argmax()
+        return int( peaks['sensor'][i] ), int( peaks['arrival'][i] )
+
+    biggestPeaks = set()
+    for center in centers:
+        p = phasor.Phasor( frames, locFile=locFile, cartesian=tuple( center ) )
+        m = phasor.MultiPhasor( frames, [center], locFile=locFile )
+        assert ( m.guesses == p.guesses ).all(), 'MultiPhasor with 1 center found different guesses than Phasor'
+        for i, ( start, stop ) in enumerate( p.guesses ):
+            assert ( m.guess_peaks( i ) == p.sortedPeaks[ start:stop ] ).all(), 'MultiPhasor guess_peaks is not Phasor.sortedPeaks'
+        biggestPeaks.update( biggest_peak( p.sortedPeaks[ start:stop ] ) for start, stop in p.guesses )
+
+    m = phasor.MultiPhasor( frames, centers, locFile=locFile )
+    keptCenters = {}
+    for i in range( len( m.guesses ) ):
+        keptCenters.setdefault( biggest_peak( m.guess_peaks( i ) ), set() ).add( m.guessCenters[i] )
+    assert all( len( c ) == 1 for c in keptCenters.values() ), 'MultiPhasor kept guesses for a peak from more than 1 center'
+    assert set( keptCenters ) == biggestPeaks, 'MultiPhasor lost some of the guesses'
+    print( 'check_multi_phasor ok' )
+
+check_multi_phasor()
+
 inLmaPaths = glob.glob( '/data/LMA/iop3/*120000.dat') 
 inLocPath  = '/data/LMA/iop3/mobile.loc'
 
@@ -21,14 +61,7 @@ windowLength = 2000000
 locFile = raw_io.LocFile( inLocPath )
 
 #load up the LMA raw data files
-lmaFiles = []
-epoch = -1
-for inPath in inLmaPaths:
-    lmaFile = raw_io.RawLMAFile( inPath )
-    lmaFiles.append( lmaFile )
-    #get the processing epoch start
-    if epoch < 0 or lmaFile.startEpoch < epoch: 
-        epoch = lmaFile.startEpoch
+networkReader = raw_io.NetworkReader( inLmaPaths, locFile )
 
 def tdoa_resid( x, data ):
     geodetic = (x[0],x[1],7000)
@@ -61,31 +94,22 @@ def toa_resid( x, data ):
     return np.array( resid )
 
 #loop over epochs, and make groups of frames to initialize Phasor objects with
-epoch -=1
 centers = []
-for iLoop in range( 10 ):
-    epoch += 1
-    frames = {}
-    for lmaFile in lmaFiles:
-    
-        #use the lookup table to get the frame number
-        if epoch in lmaFile.frameEpochs:
-            iFrame = lmaFile.frameEpochs[epoch]
-            frame = lmaFile.read_frame( iFrame )
-            #decimate the crap of out this so we don't have too many initial guesses and everything is fastpanda
-            frame.decimate( windowLength )
-            #frame goes into dict
-            frames[ frame.id ] = frame
+epoch = networkReader.startEpoch
+for frames in networkReader.iter_epochs( epoch, epoch+10 ):
+    for frame in frames.values():
+        #decimate the crap of out this so we don't have too many initial guesses and everything is fastpanda
+        frame.decimate( windowLength )
     
     p = phasor.Phasor( frames, locFile=locFile, cartesian=locFile.network.cartesian, windowLength=windowLength )
 
     #for each guess, make a solution
     solutions = []
-    for guess in p.guesses:
-        #the guess is an array of indices, pull the peak information
-        peaks = p.sortedPeaks[guess]
+    for start, stop in p.guesses:
+        #the guess is a range of indices, pull the peak information
+        peaks = p.sortedPeaks[start:stop]
         #we need to get the time of the event from this
-        nano = np.median( peaks[:,0] )
+        nano = np.median( peaks['time'] )
         s = phasor.Solution( peaks, nano, phasor=p )
         solutions.append( s )
         # print ( '%9i'%np.sqrt((s.calc_residual()**2).sum()) )
@@ -95,8 +119,8 @@ for iLoop in range( 10 ):
     for s in solutions:
         data = []
         for pk in s.selectedPeaks:
-            sensorId = chr( pk[1] )
-            nano     = pk[2]
+            sensorId = chr( pk['sensor'] )
+            nano     = pk['arrival']
             lat,lon,alt = s.loc.sensors[ sensorId ].geodetic 
             x,y,z       = s.loc.sensors[ sensorId ].cartesian 
             data.append( [nano, x, y, z] ) 
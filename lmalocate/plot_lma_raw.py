@@ -17,7 +17,7 @@ if __name__ == '__main__':
         sys.exit()
 
     #open the file
-    lmaRawData = raw_io.RawLMA( inPath )
+    lmaRawData = raw_io.RawLMAFile( inPath )
 
     #loop over each second and collect information about things
     threshold = []
@@ -26,16 +26,16 @@ if __name__ == '__main__':
     power     = []
     seconds   = []
     tStart = time.time()
-    for i in range( 1, len( lmaRawData.statusLocations ) ):
-        print(i)
-        #looking at the form of this, it's kinda stupid
-        df, statusPacket = lmaRawData.read_frame( i )
-
-        power.append( [df['power'].min(), df['power'].max()] )
-        aboveThresh.append( [df['aboveThresh'].min(), df['aboveThresh'].max()] )
-        threshold.append( 0.488*statusPacket.threshold-111.0  )
-        triggers.append( len(df) )
-        seconds.append( i )
+    for frame in lmaRawData.iter_frames():
+        if len( frame.nano ) == 0:
+            #min/max don't work on nothing
+            continue
+
+        power.append( [frame.power.min(), frame.power.max()] )
+        aboveThresh.append( [frame.aboveThresh.min(), frame.aboveThresh.max()] )
+        threshold.append( 0.488*frame.statusPacket.threshold-111.0  )
+        triggers.append( len(frame.nano) )
+        seconds.append( frame.epoch-lmaRawData.startEpoch )
     print( 'fileRead in %1.2f seconds'%(time.time()-tStart) )
 
     aboveThresh = np.array( aboveThresh )
@@ -8,25 +8,79 @@ In:
   raw lma v9  (10us)
   raw lma v10 (80us)
   raw lma v12 (80us)
+  any of those compressed with gzip, bz2, or xz
 """
 
-import struct, os, sys, time, warnings
+import struct, os, sys, time, warnings, hashlib, threading, tempfile, json, shutil, functools
+from collections import OrderedDict
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 #TODO - change to relative imports
 from common import *
 from constants import *
+from compressed import CompressedFile, compression_type
 
 
 frameDtype = [ ('nano', 'i'),
                ('power', 'f'),
                ('aboveThresh', 'i')]
 
+#smaller version of frameDtype, 7 bytes per peak instead of 12
+#the power is kept as the 8 bit maxData, and turned into dBm with powerTable 
+#when it's asked for
+compactFrameDtype = [ ('nano', 'i4'),
+                      ('maxData', 'u1'),
+                      ('aboveThresh', 'u2')]
+powerTable = ( 0.488*np.arange( 256 ) - 111.0 ).astype( 'f4' )
+
+#the GPS information from the status packets, made by decode_gps_track
+#epoch is the start of the 12 second cycle if the track is per cycle
+gpsTrackDtype = [ ('epoch', 'i8'),
+                  ('lat', 'f8'),
+                  ('lon', 'f8'),
+                  ('alt', 'f8'),
+                  ('vel', 'f8'),
+                  ('brg', 'f8'),
+                  ('satTracked', 'f8'),
+                  ('satVisible', 'f8'),
+                  ('satStat', 'f8'),
+                  ('temp', 'f8')]
+
+#one of these for each status packet in a file
+#location is the file location of the start of the status packet
+statusDtype = [ ('location', 'i8'),
+                ('epoch', 'i8'),
+                ('triggerCount', 'i4'),
+                ('threshold', 'i2'),
+                ('phaseDiff', 'i4'),
+                ('fifoStatus', 'i2'),
+                ('gpsInfo', 'i4')]
+
 class RawLMAFile:
 
-    def __init__ (self, inputPath, decimated=False ):
+    #these are saved in the status cache along with the statusIndex
+    #the satellite/temperature ones only exist if the status packets set them
+    #idBits is an array, the rest are numbers or strings
+    _cacheAttributes = ( 'version', 'id', 'netid', 'idBits', 'statusSize', 'startEpoch', 'endEpoch',
+                         'gpslat', 'gpslon', 'gpsalt', 'lat', 'lon', 'alt', 'vel', 'brg',
+                         'satTracked', 'satVisible', 'satStat', 'temp' )
+
+    def __init__ (self, inputPath, decimated=False, mmap=False, cache=False, cacheDir=None, compact=False, lazy=False ):
         """
-        inputPath = path to lma data file
+        inputPath = path to lma data file, which can be gzip, bz2, or xz compressed
         decimated = [bool] - set to True if reading decimated (rt) LMA data
+        mmap      = [bool] - set to True to memory map the file instead of using 
+                    seek/read.  Status scanning and frame reads become slices 
+                    of the one np.memmap buffer
+        cache     = [bool] - set to True to save the status index in a sidecar file, 
+                    so that re-opening the file doesn't need to find_status again
+        cacheDir  = directory for the sidecar files.  If None, they go next to the 
+                    raw data file
+        compact   = [bool] - set to True to decode frames with compactFrameDtype, 
+                    which uses a bit more than half the memory
+        lazy      = [bool] - set to True to have read_frame return frames that aren't 
+                    decoded until the data is used.  Decoded frames are kept in 
+                    frameCache, which is shared by all the files that are open
         """
 
         #lat/lon information
@@ -45,16 +99,48 @@ class RawLMAFile:
         self.startEpoch = 0
         self.endEpoch   = 0
 
+        #file locations of junk found while searching forwards for status packets
+        #the frames these are in are read as having no data packets
+        self.skippedRegions = []
+
         self.dataVersion = None #there's a number of different LMA raw data versions
         self.inputPath   = inputPath
         self.decimated   = decimated
+        self.mmap        = mmap
+        self.cache       = cache
+        self.cacheDir    = cacheDir
+        self.compact     = compact
+        self.lazy        = lazy
+        self._lock       = threading.Lock()
+        self._frameCacheKey = None
         #try opening the inputPath, that should work if it exists
         if os.path.exists( self.inputPath ):
-            self.inputFile = open( self.inputPath, 'rb' )
-            self.inputFileSize = os.path.getsize( self.inputPath )
+            self.compressed = compression_type( self.inputPath ) is not None
+            if self.compressed:
+                #this decompresses the whole file once, to make the checkpoints 
+                #that let us seek around in it.  They're saved in the status cache
+                #so that only has to happen the first time
+                if self.mmap:
+                    raise Exception( 'RawLMA.__init__: compressed files can not be memory mapped: %s'%self.inputPath )
+                index = self._load_compressed_index() if self.cache else None
+                self._indexCached  = index is not None
+                self.inputFile     = CompressedFile( self.inputPath, index=index )
+                self.inputBuffer   = None
+                self.inputFileSize = self.inputFile.size
+            elif self.mmap:
+                self.inputFile     = None
+                self.inputBuffer   = np.memmap( self.inputPath, dtype='u1', mode='r' )
+                self.inputFileSize = os.path.getsize( self.inputPath )
+            else:
+                self.inputFile     = open( self.inputPath, 'rb' )
+                self.inputBuffer   = None
+                self.inputFileSize = os.path.getsize( self.inputPath )
         else:
             raise Exception( 'RawLMA.__init__: inputPath does not exist: %s'%self.inputPath )
         
+        #frames in the frameCache are only good for this version of the file
+        self._frameCacheKey = self._cache_key() + ( self.decimated, self.compact )
+
         #we need to find the file locations of each of the status words
         #these will break up the file into 1 second chunks
         self.find_status()
@@ -73,11 +159,8 @@ class RawLMAFile:
             self.cartesian = None
 
     def make_frameEpochs(self):
-        self.frameEpochs = {}
-        for iFrame in range( 1, len(self.statusPackets) ):
-            epoch = self.statusPackets[iFrame].epoch
-            self.frameEpochs[ epoch ] = iFrame
-
+        #frame 0 has no data, so it isn't something you can look up
+        self.frameEpochs = FrameEpochs( self.statusIndex['epoch'][1:], offset=1 )
 
     def convert_latlon( self, gpsInt):
         """
@@ -93,10 +176,34 @@ class RawLMAFile:
         latlon = gpsInt *90/324000000.0
         return latlon
 
+    def close( self ):
+        """
+        Close the file.  The status index is still around, but frames can't be read anymore
+        """
+        if self.inputFile is not None:
+            self.inputFile.close()
+        #there's no close for a memmap, it goes away when nothing refers to it
+        self.inputBuffer = None
+
+    def _read( self, fileLocation, size ):
+        """
+        Read size bytes starting at fileLocation
+        In mmap mode, this is a slice of the memmap buffer rather than a copy
+        """
+        if self.mmap:
+            return self.inputBuffer[ fileLocation:fileLocation+size ]
+        #the seek and read have to go together if there's more than one thread
+        with self._lock:
+            self.inputFile.seek( fileLocation )
+            return self.inputFile.read( size )
+
     def find_status( self ):
-        self.statusLocations = []
-        self.statusPackets   = []
-        self.inputFile.seek( 0 )
+        #we might have done this already
+        if self.cache and self._load_status_cache():
+            if self.compressed and not self._indexCached:
+                #caches from before the compressed file checkpoints were saved
+                self._save_status_cache()
+            return
 
         #the LMA raw data uses the first bit of the data words to make a pattern
         #the data packets have first bytes that go 0, 1, 0
@@ -108,10 +215,11 @@ class RawLMAFile:
         #but, the status comes at the end of the data.  We need to scan backwards 
         #from the end of the file, but to do that we need to know the data version
         #so we know how big a status packet is
-        statusPacket = StatusPacket( self.inputFile.read(18) )
+        statusPacket = StatusPacket( self._read( 0, 18 ) )
         self.version = statusPacket.version
         self.id      = statusPacket.id
         self.netid   = statusPacket.netid
+        self.idBits  = status_id_bits( np.array( [statusPacket.words] ), self.version )[0]
         #this is the first status message, there are no frames associated with it
         #but we can use it to get the starting epoch of the file
         self.startEpoch = statusPacket.epoch+1  
@@ -122,69 +230,242 @@ class RawLMAFile:
 
         if self.decimated:
             #this is way slower
-            self._search_forwards()
+            statusLocations = self._search_forwards()
         else:
             #this is faster
-            self._search_backwards()
+            statusLocations = self._search_backwards()
+
+        #now that we know where all the status packets are, decode them all at once
+        words = self._read_status_words( statusLocations )
+        self.statusIndex = decode_status_packets( words, self.version, statusLocations )
+        self.statusLocations = self.statusIndex['location']
+
+        #the station id bits should be the same for all status packets in the file
+        idBits = status_id_bits( words, self.version )
+        if (idBits != idBits[0]).any():
+            #well that's funny
+            raise Exception( 'RawLMAFile.find_status : statusPacket id not consistent in file')
+
+        #the first status shouldn't be used, there are no data packets associated with it
+        if len( self.statusIndex ) > 1:
+            self.endEpoch = int( self.statusIndex['epoch'][1:].max() )
+
+        #GPS Stuff
+        self.set_gps()
+
+        if self.cache:
+            self._save_status_cache()
+
+    def status_cache_path( self ):
+        """
+        Path to the sidecar file used to cache the status index
+        The forwards and backwards searches can give different answers, 
+        so they get different files
+        """
+        suffix = '.rtstatus.npz' if self.decimated else '.status.npz'
+        if self.cacheDir is None:
+            return self.inputPath + suffix
+        #everything in the cacheDir is flat, so we need the whole path 
+        #in the name to keep files with the same name apart
+        pathHash = hashlib.md5( os.path.abspath( self.inputPath ).encode() ).hexdigest()[:12]
+        return os.path.join( self.cacheDir, '%s.%s%s'%(os.path.basename(self.inputPath), pathHash, suffix) )
+
+    def _cache_key( self ):
+        #if any of these change, the cache is no good
+        stat = os.stat( self.inputPath )
+        return os.path.abspath( self.inputPath ), stat.st_size, stat.st_mtime_ns
+
+    def _cache_is_current( self, cached ):
+        #the raw file could have changed, or this could be a different file 
+        path, size, mtime = self._cache_key()
+        return str( cached['path'] ) == path and int( cached['size'] ) == size and int( cached['mtime'] ) == mtime
+
+    def _load_status_cache( self ):
+        """
+        Load the statusIndex and header information from the cache
+        returns True if it worked, and False if there's no (valid) cache
+        """
+        cachePath = self.status_cache_path()
+        if not os.path.exists( cachePath ):
+            return False
+        try:
+            with np.load( cachePath, allow_pickle=False ) as cached:
+                if not self._cache_is_current( cached ):
+                    return False
+                self.statusIndex = cached['statusIndex']
+                for attribute in self._cacheAttributes:
+                    if attribute in cached:
+                        value = cached[attribute]
+                        setattr( self, attribute, value.item() if value.ndim == 0 else value )
+                if 'skippedRegions' in cached:
+                    self.skippedRegions = [ ( int( start ), int( stop ) ) for start, stop in cached['skippedRegions'] ]
+        except Exception as e:
+            warnings.warn( 'RawLMAFile._load_status_cache - could not read %s: %s'%(cachePath, e) )
+            return False
+        self.statusLocations = self.statusIndex['location']
+        if not hasattr( self, 'idBits' ):
+            #caches from before idBits was saved, poll needs it to scan for new status packets
+            words = self._read_status_words( self.statusLocations[:1] )
+            self.idBits = status_id_bits( words, self.version )[0]
+        return True
+
+    def _load_compressed_index( self ):
+        """
+        The CompressedFile checkpoints from the status cache, 
+        returns None if there's no (valid) cache or they aren't in it
+        """
+        cachePath = self.status_cache_path()
+        if not os.path.exists( cachePath ):
+            return None
+        try:
+            with np.load( cachePath, allow_pickle=False ) as cached:
+                if not self._cache_is_current( cached ):
+                    return None
+                index = { key[len('compressedIndex_'):]:cached[key] for key in cached.files if key.startswith( 'compressedIndex_' ) }
+        except Exception as e:
+            warnings.warn( 'RawLMAFile._load_compressed_index - could not read %s: %s'%(cachePath, e) )
+            return None
+        return index if index else None
+
+    def _save_status_cache( self ):
+        cachePath = self.status_cache_path()
+        path, size, mtime = self._cache_key()
+        cached = { 'path':path, 'size':size, 'mtime':mtime, 'statusIndex':self.statusIndex }
+        for attribute in self._cacheAttributes:
+            if hasattr( self, attribute ):
+                cached[ attribute ] = getattr( self, attribute )
+        #the (start, stop) pairs, so a reopened file still knows where the junk is
+        cached['skippedRegions'] = np.array( self.skippedRegions, dtype='i8' ).reshape( -1, 2 )
+        if self.compressed:
+            #the checkpoints, so opening the file again doesn't need to decompress all of it
+            for key, value in self.inputFile.get_index().items():
+                cached[ 'compressedIndex_'+key ] = value
+        try:
+            if self.cacheDir is not None and not os.path.exists( self.cacheDir ):
+                os.makedirs( self.cacheDir )
+            #write then move, so nobody reads a half written cache file
+            #the name has to end in .npz or numpy will add it
+            tmpPath = cachePath + '.%i.tmp.npz'%os.getpid()
+            np.savez( tmpPath, **cached )
+            os.replace( tmpPath, cachePath )
+        except Exception as e:
+            #not being able to cache isn't a big deal, the archive may be read only
+            warnings.warn( 'RawLMAFile._save_status_cache - could not write %s: %s'%(cachePath, e) )
+
+    def _read_status_words( self, statusLocations ):
+        """
+        Read the status packets at all of the statusLocations, 
+        returns an int16 array of words with one row per status packet
+        """
+        if self.mmap:
+            i = statusLocations[:,None] + np.arange( self.statusSize )
+            statusBytes = self.inputBuffer[ i ]
+        else:
+            statusBytes = b''.join( [self._read( l, self.statusSize ) for l in statusLocations] )
+        return np.frombuffer( statusBytes, dtype='<i2' ).reshape( len(statusLocations), -1 )
 
     def _search_forwards( self ):
-        self.statusLocations.append( 0 )
-        self.statusPackets.append( None )   #the first status shouldn't be used
+        #the first status shouldn't be used, but it goes in the list anyways
+        statusLocations, self.skippedRegions = self._scan_forwards( self.statusSize, self.inputFileSize )
 
-        fileLocation = self.statusSize
-        while fileLocation < os.path.getsize( self.inputPath ):
-            self.inputFile.seek( fileLocation )
-            try:
-                statusPacket = StatusPacket( self.inputFile.read(self.statusSize) )
-                if statusPacket.id != self.id or statusPacket.netid != self.netid:
-                    #well that's funny, these should be the same for all status packets in the file
-                    raise Exception( 'RawLMAFile._searchForwards : statusPacket id not consistent in file')
-                
-                #update ending epoch
-                if statusPacket.epoch > self.endEpoch: 
-                    #the statusPackets are time ordered, and we're searching forward.
-                    #this should always be true
-                    self.endEpoch = statusPacket.epoch
-
-                #if we could read the statusPacket, we're in the right spot
-                self.statusLocations.append( fileLocation )
-                self.statusPackets.append( statusPacket )
-
-                #GPS Stuff
-                self. decode_gpsInfo( statusPacket )
-
-                fileLocation += self.statusSize
-            
-            except:
-                #means that the bit pattern was wrong
-                fileLocation += 3
+        if len( self.skippedRegions ) > 0:
+            skippedBytes = sum( [stop-start for start, stop in self.skippedRegions] )
+            warnings.warn( 'RawLMAFile._search_forwards - skipped %i regions (%i bytes) that are not status or data packets in %s'%(len(self.skippedRegions), skippedBytes, self.inputPath) )
+
+        return np.concatenate( [[0], statusLocations] ).astype( 'i8' )
+
+    def _scan_forwards( self, fileLocation, fileEnd ):
+        """
+        Find the status packets between fileLocation and fileEnd
+        
+        Rather than trying to decode a StatusPacket at every location, this looks for 
+        runs of negative words the length of a status packet, and checks all of 
+        them at once.  This is not bothered by junk in the file, even if the junk 
+        is an odd number of bytes
+
+        returns the file locations of the status packets, and a list of (start, stop) 
+        file locations of the regions between status packets that were not data packets
+        """
+        data = np.frombuffer( self._read( fileLocation, fileEnd-fileLocation ), dtype='u1' )
+        nWords = self.statusSize//2
+
+        #the words are little endian, so a word is negative if the top bit of it's 
+        #2nd byte is set.  Using the bytes means we don't care if the words start 
+        #on even or odd bytes
+        highBit = data >= 0x80
+        candidates = []
+        for parity in (0,1):
+            negative = highBit[ parity+1::2 ].astype( 'i1' )
+            #find runs of negative words
+            edges = np.diff( np.concatenate( [[0], negative, [0]] ) )
+            runStarts = np.flatnonzero( edges == 1 )
+            runEnds   = np.flatnonzero( edges == -1 )
+            runLength = runEnds - runStarts
+
+            #a run can be a few status packets in a row, if there were no triggers
+            nPackets = runLength//nWords
+            starts = expand_ranges( runStarts, nPackets, nWords )
+            #if the run isn't a whole number of status packets, there's some junk 
+            #on one end of it.  Try lining up with the end of the run as well
+            odd = runLength%nWords != 0
+            starts = np.concatenate( [starts, expand_ranges( runEnds[odd]-nPackets[odd]*nWords, nPackets[odd], nWords )] )
+
+            candidates.append( parity + 2*starts )
+        candidates = np.unique( np.concatenate( candidates ) )
+
+        #check all the candidates in one go
+        i = candidates[:,None] + np.arange( self.statusSize )
+        words = data[ i ].view( '<i2' ).reshape( len(candidates), nWords )
+        valid = check_status_packets( words, self.version )
+        valid &= ( status_id_bits( words, self.version ) == self.idBits ).all( axis=1 )
+        candidates = candidates[ valid ]
+
+        #it's very unlikely, but check that none of the status packets overlap
+        statusLocations = []
+        lastEnd = 0
+        for location in candidates:
+            if location < lastEnd: continue
+            statusLocations.append( location )
+            lastEnd = location + self.statusSize
+        statusLocations = np.array( statusLocations, dtype='i8' )
+
+        #the stuff in between the status packets should be data packets, so it 
+        #should be a multiple of 6 bytes long, and have the +,-,+ pattern
+        gapStarts = np.concatenate( [[0], statusLocations+self.statusSize] )[ :len(statusLocations) ].astype( 'i8' )
+        gapStops  = statusLocations
+        gapLength = gapStops - gapStarts
+        skipped   = gapLength%6 != 0
+        nPackets  = np.where( skipped, 0, gapLength//6 )
+        packetStarts = expand_ranges( gapStarts, nPackets, 6 )
+        badPackets   = highBit[ packetStarts+1 ] | ~highBit[ packetStarts+3 ] | highBit[ packetStarts+5 ]
+        skipped[ np.repeat( np.arange( len(gapStarts) ), nPackets )[ badPackets ] ] = True
+        skippedRegions = [ (int(start)+fileLocation, int(stop)+fileLocation) for start, stop in zip( gapStarts[skipped], gapStops[skipped] ) ]
+
+        return statusLocations+fileLocation, skippedRegions
 
     def _search_backwards(self):
         #now search for the remaining status packets in reverse, start by 
-        #seeking to the end of the file
-        self.inputFile.seek(0, 2)
-        while self.inputFile.tell() > self.statusSize:
-            self.inputFile.seek( -self.statusSize, 1 )
-            self.statusLocations.append( self.inputFile.tell() )
-            statusPacket = StatusPacket( self.inputFile.read(self.statusSize) )
-            self.statusPackets.append( statusPacket )
-
-            if statusPacket.id != self.id or statusPacket.netid != self.netid:
-                #well that's funny, these should be the same for all status packets in the file
-                raise Exception( 'RawLMAFile._searchForwards : statusPacket id not consistent in file')
-
-            #update ending epoch
-            if statusPacket.epoch > self.endEpoch: 
-                #the statusPackets are time ordered, and we're searching backwards.
-                #this should only be true once
-                self.endEpoch = statusPacket.epoch
-
-            #GPS Stuff
-            self. decode_gpsInfo( statusPacket )
-
-            #determine how far back to seek
-            if self.inputFile.tell() > statusPacket.triggerCount * 6 + self.statusSize:
-                self.inputFile.seek( -statusPacket.triggerCount * 6 -self.statusSize, 1)
+        #going to the end of the file
+        #all we need from each status packet is the triggerCount, the rest 
+        #of the decoding happens all at once later
+        statusLocations = []
+        fileLocation = self.inputFileSize
+        while fileLocation > self.statusSize:
+            fileLocation -= self.statusSize
+            statusLocations.append( fileLocation )
+
+            #triggerCount is in the 5th word (and the 6th for v8/9)
+            words = struct.unpack( '<2h', self._read( fileLocation+8, 4 ) )
+            if words[0] >= 0 or words[1] >= 0:
+                raise Exception( "Malformed status packet doesn't follow bit pattern" )
+            if self.version < 10:
+                triggerCount = (words[1]&0x1FF) | (words[0]&0x7F)<<9
+            else:
+                triggerCount = words[0] &0x3FFF
+
+            #determine how far back to go
+            if fileLocation > triggerCount * 6:
+                fileLocation -= triggerCount * 6
             else:
                 #this really shouldn't happen
                 #because the raw file should start with a status
@@ -195,119 +476,422 @@ class RawLMAFile:
         #we didn't add the first status packet to the list, and that's ok 
         #because there are no data packets associated with it (they're in the previous file)
         #but, we would like to add in the location, to make later math a little easier
-        self.statusLocations.append( 0 )
-        self.statusPackets.append( None )   #the first status shouldn't be used
+        statusLocations.append( 0 )
 
         #the information on the status packets is reversed
-        self.statusLocations.reverse()
-        self.statusPackets.reverse()
-
-    def decode_gpsInfo( self, statusPacket ):
-            #handle GPS info
-            if statusPacket.second %12 ==0:
-                #lat bytes 4/3
-                self.gpslat = (statusPacket.gpsInfo<<16) | (self.gpslat &0xFFFF)
-                self.lat = self.convert_latlon( self.gpslat )
-            elif statusPacket.second %12 ==1:
-                #lat bytes 2/1
-                self.gpslat = (statusPacket.gpsInfo) | (self.gpslat &0xFFFF0000)
-                self.lat = self.convert_latlon( self.gpslat )
-            elif statusPacket.second %12 ==2:
-                #lon bytes 4/3
-                self.gpslon = (statusPacket.gpsInfo<<16) | (self.gpslon &0xFFFF)
-                self.lon = self.convert_latlon( self.gpslon )
-            elif statusPacket.second %12 ==3:
-                #lon bytes 2/1
-                # self.gpslon = (statusPacket.gpsInfo<<16) | (self.gpslon &0xFFFF)
-                self.gpslon = (statusPacket.gpsInfo) | (self.gpslon &0xFFFF0000)
-                self.lon = self.convert_latlon( self.gpslon )
-            elif statusPacket.second %12 ==4:
-                #alt bytes 4/3
-                self.gpsalt = (statusPacket.gpsInfo<<16) | (self.gpsalt &0xFFFF)
-                self.alt = self.gpsalt/100.0
-            elif statusPacket.second %12 ==5:
-                #alt bytes 2/1
-                self.gpsalt = (statusPacket.gpsInfo) | (self.gpsalt &0xFFFF0000)
-                self.alt = self.gpsalt/100.0
-            elif statusPacket.second %12 ==6:
-                #vel bytes 4/3
-                self.vel = (statusPacket.gpsInfo<<16) | (self.vel &0xFFFF)
-            elif statusPacket.second %12 ==7:
-                #vel bytes 2/1
-                self.vel = (statusPacket.gpsInfo) | (self.vel &0xFFFF0000)
-            elif statusPacket.second %12 ==8:
-                #brg 
-                self.brg = statusPacket.gpsInfo
-            elif statusPacket.second %12 ==9:
-                #vis/tracked satellites
-                self.satTracked = (statusPacket.gpsInfo>>8) &0xFF
-                self.satVisible = statusPacket.gpsInfo &0xFF
-            elif statusPacket.second %12 ==10:
-                #statellite stat?
-                self.satStat = statusPacket.gpsInfo &0xFFF
-            elif statusPacket.second %12 ==11:
-                #temperature 
-                self.temp = (statusPacket.gpsInfo>>8)-40
+        statusLocations.reverse()
+        return np.array( statusLocations, dtype='i8' )
+
+    def status_packet( self, iStatus ):
+        """
+        Make the full StatusPacket object for the ith status message
+        The statusIndex has most of the information, but LMAFrame wants one of these
+        """
+        statusPacket = StatusPacket( self._read( self.statusLocations[iStatus], self.statusSize ) )
+        #set status GPS information
+        statusPacket.geodetic  = self.geodetic
+        statusPacket.cartesian = self.cartesian
+        return statusPacket
+
+    def set_gps( self ):
+        """
+        Set the GPS attributes (lat, lon, alt, ...) to the last values sent in the 
+        status packets, using decode_gps_slots on all of them at once
+        """
+        statusIndex = self.statusIndex[1:]
+        if len( statusIndex ) == 0 or self.version < 10:
+            #v8/9 don't have GPS information
+            return
+        values, seen = decode_gps_slots( statusIndex['epoch'], statusIndex['gpsInfo'] )
+        values = [ int(v) for v in values[-1] ]
+        seen   = seen[-1]
+        #the 32 bit values come in 2 halves, if we've only seen 1 the other is 0
+        if seen[0] or seen[1]:
+            self.gpslat = (values[0]<<16) | values[1]
+            self.lat = self.convert_latlon( self.gpslat )
+        if seen[2] or seen[3]:
+            self.gpslon = (values[2]<<16) | values[3]
+            self.lon = self.convert_latlon( self.gpslon )
+        if seen[4] or seen[5]:
+            self.gpsalt = (values[4]<<16) | values[5]
+            self.alt = self.gpsalt/100.0
+        if seen[6] or seen[7]:
+            self.vel = (values[6]<<16) | values[7]
+        if seen[8]:
+            self.brg = values[8]
+        if seen[9]:
+            self.satTracked = (values[9]>>8) &0xFF
+            self.satVisible = values[9] &0xFF
+        if seen[10]:
+            self.satStat = values[10] &0xFFF
+        if seen[11]:
+            self.temp = (values[11]>>8)-40
+
+    def gps_track( self, perCycle=False ):
+        """
+        The GPS information from all the status packets in the file, as arrays
+
+        perCycle = [bool] - if True, there's one row per 12 second GPS cycle, with 
+                   the values at the end of the cycle.  Otherwise there's one 
+                   row per frame
+
+        returns a structured numpy array with gpsTrackDtype
+        """
+        statusIndex = self.statusIndex[1:]
+        return decode_gps_track( statusIndex['epoch'], statusIndex['gpsInfo'], perCycle=perCycle )
 
     def read_frame( self, iStatus):
         """
         Read in all the datapackets associated with the ith status message
 
-        returns a structured numpy array
+        returns an LMAFrame
         """
-        ###
-        # Profiling indicates that the bottle neck for reading data is in the decoding
-        # rather than in the reading.  If it were the read, we could probably improve 
-        # things by reading larger blocks all at once
-        # The decoding is all the bit-shift stuff that happens because of the uniquely 
-        # anoying way that Rison has split data between words in the file.  
-        # Speeding this up will require moving the decode methods over to Cython
-        # Current performance benchmark: 1 ten minute file is read and decoded in about 4 seconds
-
         if iStatus <= 0 or iStatus >= len(self.statusLocations) :
             raise Exception( "Can't read the %ith collection of data, choose number between 1 and %i"%(iStatus, len(self.statusLocations)-1) )
 
+        return self.read_frames( iStatus, iStatus+1 )[0]
+
+    def read_frames( self, iStart, iStop ):
+        """
+        Read in all the datapackets associated with status messages iStart to iStop-1
+        This is done with 1 read, and all the data packets are decoded together
+        If the file is lazy, only the status packets are read now
+
+        returns a list of LMAFrames
+        """
+        if self.lazy:
+            if iStart <= 0 or iStop > len(self.statusLocations) or iStart >= iStop:
+                raise Exception( "Can't read collections %i to %i of data, choose numbers between 1 and %i"%(iStart, iStop-1, len(self.statusLocations)-1) )
+            return [ LMAFrame( self.status_packet( i ), loader=functools.partial( self._load_frame, i ) ) for i in range( iStart, iStop ) ]
+        return self._read_frames( iStart, iStop )
+
+    def _load_frame( self, iStatus ):
+        """
+        Get the decoded peaks for a lazy frame, from frameCache if they're there
+        """
+        key = self._frameCacheKey + ( iStatus, )
+        dataArray = frameCache.get( key )
+        if dataArray is None:
+            dataArray = self._read_frames( iStatus, iStatus+1 )[0]._arr
+            frameCache.put( key, dataArray )
+        return dataArray
+
+    def _read_frames( self, iStart, iStop ):
+        ###
+        # Profiling indicated that the bottle neck for reading data was in the decoding
+        # rather than in the reading.  The decoding is all the bit-shift stuff that
+        # happens because of the uniquely anoying way that Rison has split data between
+        # words in the file.
+        # Decoding 1 DataPacket at a time, 1 ten minute file was read and decoded in about 4 seconds
+        # Now the frames are read in one go and decoded with numpy (decode_data_packets)
+
+        if iStart <= 0 or iStop > len(self.statusLocations) or iStart >= iStop:
+            raise Exception( "Can't read collections %i to %i of data, choose numbers between 1 and %i"%(iStart, iStop-1, len(self.statusLocations)-1) )
 
-        #we get the start and end point of our read from the statusLocations
+        #we get the start and end point of each frame from the statusLocations
         #those are file locations.  We need to offset the start point by the 
         #size of 1 statusPacket though
-        readStart = self.statusLocations[ iStatus-1 ]+self.statusSize
-        readEnd   = self.statusLocations[ iStatus ]
-
-        #Get some information we'll need from the assoicated status packet
-        statusPacket = self.statusPackets[ iStatus ]
-        #set status GPS information
-        statusPacket.geodetic = self.geodetic
-        statusPacket.cartesian = self.cartesian
+        frameStarts = self.statusLocations[ iStart-1:iStop-1 ]+self.statusSize
+        frameEnds   = self.statusLocations[ iStart:iStop ]
+
+        #get things we need from the status index
+        version    = self.version    #needed for dataPacket format
+        phaseDiffs = self.statusIndex['phaseDiff'][ iStart:iStop ]  #only if we want good timinh
+        triggerCounts = self.trigger_counts( iStart, iStop ) #this is how many dataPackets there will be
+
+        #read everything in one go, including the status packet at the end of the last frame
+        #in mmap mode this is a view of the file, not a copy
+        readStart = int( frameStarts[0] )
+        readEnd   = int( frameEnds[-1] )+self.statusSize
+        block = np.frombuffer( self._read( readStart, readEnd-readStart ), dtype='u1' )
+
+        dataArray = decode_frame_block( block, frameStarts-readStart, triggerCounts, phaseDiffs, version, compact=self.compact )
+
+        #and then split them up again into frames
+        frames = []
+        packetOffsets = np.concatenate( [[0], np.cumsum( triggerCounts )] )
+        for i in range( iStop-iStart ):
+            statusStart  = int( frameEnds[i] )-readStart
+            statusPacket = StatusPacket( block[ statusStart:statusStart+self.statusSize ] )
+            #set status GPS information
+            statusPacket.geodetic  = self.geodetic
+            statusPacket.cartesian = self.cartesian
+            frames.append( LMAFrame( statusPacket, inputArray=dataArray[ packetOffsets[i]:packetOffsets[i+1] ] ) )
+
+        return frames
+
+    def trigger_counts( self, iStart=1, iStop=None ):
+        """
+        The number of data packets in frames iStart to iStop-1
+        """
+        if iStop is None:
+            iStop = len( self.statusLocations )
+        frameStarts = self.statusLocations[ iStart-1:iStop-1 ]+self.statusSize
+        frameEnds   = self.statusLocations[ iStart:iStop ]
 
-        #get other things from the status packet
-        version   = statusPacket.version    #needed for dataPacket format
-        phaseDiff = statusPacket.phaseDiff  #only if we want good timinh
         if not self.decimated:
-            triggerCount= statusPacket.triggerCount #this is how many dataPackets there will be
+            triggerCounts = self.statusIndex['triggerCount'][ iStart:iStop ].astype( 'i8' )
         else:
             #we can't trust the triggerCount for decimated data
-            triggerCount = int( (readEnd-readStart)/6 )
-
-        #data is going into this thing.  
-        #the structured type is needlessly fancy.  Could be worse and be a pandas dataframe thing
-        dataArray = np.zeros( triggerCount, dtype=frameDtype)
-
-        self.inputFile.seek( readStart )
-        for i in range( triggerCount ):
-            if self.inputFile.tell() >= readEnd:
-                raise Exception( "RawLMA.read - data packet reading is out of bounds, %i>=%i"%(self.inputFile.tell(), readEnd))
-            d = DataPacket( self.inputFile.read(6), version=version, phaseDiff=phaseDiff )
-            
-            dataArray['nano'][i]        = d.nano
-            dataArray['power'][i]       = d.power
-            dataArray['aboveThresh'][i] = d.aboveThresh
-        
-        return LMAFrame( statusPacket, inputArray=dataArray )
+            triggerCounts = (frameEnds-frameStarts)//6
+
+        #frames with junk in them were skipped when the file was scanned, so they 
+        #get no data packets.  There's no telling which of the packets are any good
+        if len( self.skippedRegions ) > 0:
+            skippedStarts = np.array( [ start for start, stop in self.skippedRegions ], dtype='i8' )
+            triggerCounts[ np.isin( frameStarts, skippedStarts ) ] = 0
+
+        outOfBounds = frameStarts + triggerCounts*6 > frameEnds
+        if outOfBounds.any():
+            i = np.flatnonzero( outOfBounds )[0]
+            raise Exception( "RawLMA.read - data packet reading is out of bounds, %i>=%i"%(frameStarts[i]+triggerCounts[i]*6, frameEnds[i]))
+        return triggerCounts
+
+    def iter_frames( self, start_epoch=None, end_epoch=None, chunk_seconds=10 ):
+        """
+        Generator that goes through the file frame by frame, in order
+
+        start_epoch   - first epoch to read, defaults to the start of the file
+        end_epoch     - read frames with epochs before this, defaults to the end of the file
+        chunk_seconds - number of frames read and decoded at once.  Memory use is 
+                        bounded by this many frames
+
+        yields LMAFrames
+        """
+        epochs = self.statusIndex['epoch']
+        selected = np.ones( len(epochs), dtype='bool' )
+        selected[0] = False     #the first status has no data
+        if start_epoch is not None:
+            selected &= epochs >= start_epoch
+        if end_epoch is not None:
+            selected &= epochs < end_epoch
+
+        #frames are read in contiguous chunks
+        iFrames = np.flatnonzero( selected )
+        #places where the selected frames are not next to each other
+        breaks = np.flatnonzero( np.diff( iFrames ) != 1 ) + 1
+        for run in np.split( iFrames, breaks ):
+            for iStart in range( 0, len(run), chunk_seconds ):
+                chunk = run[ iStart:iStart+chunk_seconds ]
+                for frame in self.read_frames( int(chunk[0]), int(chunk[-1])+1 ):
+                    yield frame
+
+    def poll( self ):
+        """
+        Look for frames that have been written to the end of the file since it 
+        was opened (or since the last poll), for real time files that are still 
+        being written.  Only the new part of the file is scanned
+
+        returns a list of the new LMAFrames, which may be empty
+        """
+        if self.compressed:
+            #nobody's writing to a compressed file
+            return []
+        #a status packet ends each frame, so everything up to the end of the 
+        #last one we found is done.  Anything after that might be half written
+        scanStart = int( self.statusLocations[-1] ) + self.statusSize
+        fileSize  = os.path.getsize( self.inputPath )
+        if fileSize <= scanStart:
+            return []
+        if self.mmap:
+            #the old map doesn't know the file got bigger
+            self.inputBuffer = np.memmap( self.inputPath, dtype='u1', mode='r' )
+        self.inputFileSize = fileSize
+
+        statusLocations, skippedRegions = self._scan_forwards( scanStart, fileSize )
+        if len( statusLocations ) == 0:
+            return []
+        #the junk after the last new status could still be a frame being written
+        self.skippedRegions += skippedRegions
+        if len( skippedRegions ) > 0:
+            warnings.warn( 'RawLMAFile.poll - skipped %i regions that are not status or data packets in %s'%(len(skippedRegions), self.inputPath) )
+
+        words = self._read_status_words( statusLocations )
+        statusIndex = decode_status_packets( words, self.version, statusLocations )
+        iFirst = len( self.statusIndex )
+        self.statusIndex     = np.concatenate( [self.statusIndex, statusIndex] )
+        self.statusLocations = self.statusIndex['location']
+        self.frameEpochs.extend( statusIndex['epoch'] )
+        self.endEpoch = max( self.endEpoch, int( statusIndex['epoch'].max() ) )
+
+        #GPS Stuff
+        self.set_gps()
+
+        return self.read_frames( iFirst, len( self.statusIndex ) )
+
+    def follow( self, pollInterval=1.0, timeout=None ):
+        """
+        Generator that yields new frames as they are written to the end of the file
+
+        pollInterval - seconds to wait between looking for new data
+        timeout      - stop if nothing new shows up for this many seconds, 
+                       or never stop if None
+
+        yields LMAFrames
+        """
+        lastNew = time.time()
+        while True:
+            frames = self.poll()
+            for frame in frames:
+                yield frame
+            if len( frames ) > 0:
+                lastNew = time.time()
+            elif timeout is not None and time.time()-lastNew >= timeout:
+                return
+            else:
+                time.sleep( pollInterval )
+
+def expand_ranges( starts, counts, step=1 ):
+    """
+    Makes one array out of a bunch of ranges, without looping over them
+    The same as np.concatenate( [np.arange(start, start+count*step, step) for ...] )
+    """
+    starts = np.asarray( starts, dtype='i8' )
+    counts = np.asarray( counts, dtype='i8' )
+    #the position of each element in its own range
+    offsets = np.arange( counts.sum() ) - np.repeat( np.cumsum( counts )-counts, counts )
+    return np.repeat( starts, counts ) + offsets*step
+
+class FrameEpochs:
+    """
+    Lookup table going from epoch to frame number.  This acts like a (read only) dict, 
+    but uses searchsorted on the epochs from the status index instead of hashing
+    """
+
+    def __init__( self, epochs, offset=0 ):
+        """
+        epochs = array of epochs, 1 per frame
+        offset = frame number of the first epoch in the array
+        """
+        self.epochs = epochs
+        self.offset = offset
+        #epochs should already be in order, but GPS can do funny things
+        self._sorter = np.argsort( self.epochs, kind='stable' )
+
+    def get( self, epoch, default=None ):
+        #if the same epoch is in there twice, use the last one (like the dict did)
+        i = np.searchsorted( self.epochs, epoch, side='right', sorter=self._sorter ) - 1
+        if i < 0 or self.epochs[ self._sorter[i] ] != epoch:
+            return default
+        return int( self._sorter[i] ) + self.offset
+
+    def extend( self, epochs ):
+        """
+        Add the epochs of frames that come after the ones we already have
+        """
+        nOld = len( self.epochs )
+        sorter = np.argsort( epochs, kind='stable' ) + nOld
+        self.epochs = np.concatenate( [self.epochs, epochs] )
+        if nOld == 0 or len( epochs ) == 0 or self.epochs[ sorter[0] ] >= self.epochs[ self._sorter[-1] ]:
+            #the usual case, the new stuff all goes on the end
+            self._sorter = np.concatenate( [self._sorter, sorter] )
+        else:
+            self._sorter = np.argsort( self.epochs, kind='stable' )
+
+    def __getitem__( self, epoch ):
+        iFrame = self.get( epoch )
+        if iFrame is None:
+            raise KeyError( epoch )
+        return iFrame
+
+    def __contains__( self, epoch ):
+        return self.get( epoch ) is not None
+
+    def __len__( self ):
+        return len( np.unique( self.epochs ) )
+
+    def __iter__( self ):
+        return iter( self.keys() )
+
+    def keys( self ):
+        return [ int(epoch) for epoch in np.unique( self.epochs ) ]
+
+    def items( self ):
+        return [ (epoch, self[epoch]) for epoch in self.keys() ]
+
+class FrameCache:
+
+    def __init__( self, maxBytes=256*1024**2 ):
+        """
+        Least recently used cache of decoded frames, limited by the total size of the 
+        arrays in it.  The cached arrays are made read only, so a frame that wants to 
+        change it's data has to copy it first (which LMAFrame does)
+
+        maxBytes = how much memory the cache is allowed to use
+        """
+        self.maxBytes  = maxBytes
+        self.nBytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._entries  = OrderedDict()
+        self._lock     = threading.Lock()
+
+    def get( self, key ):
+        """
+        returns the array for key, or None if it's not in the cache
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end( key )
+            return self._entries[ key ]
+
+    def put( self, key, arr ):
+        arr.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.nBytes -= self._entries.pop( key ).nbytes
+            self._entries[ key ] = arr
+            self.nBytes += arr.nbytes
+            self._evict()
+
+    def resize( self, maxBytes ):
+        with self._lock:
+            self.maxBytes = maxBytes
+            self._evict()
+
+    def clear( self ):
+        with self._lock:
+            self._entries.clear()
+            self.nBytes = 0
+
+    def stats( self ):
+        """
+        returns a dict of the cache hit/miss statistics and memory use
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return { 'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions, 
+                     'hitRate':self.hits/lookups if lookups else 0.0, 
+                     'entries':len( self._entries ), 'nBytes':self.nBytes, 'maxBytes':self.maxBytes }
+
+    def _evict( self ):
+        #throw out the oldest stuff until we fit, needs the lock held
+        while self.nBytes > self.maxBytes and self._entries:
+            key, arr = self._entries.popitem( last=False )
+            self.nBytes -= arr.nbytes
+            self.evictions += 1
+
+#shared by all the RawLMAFiles in the process
+frameCache = FrameCache()
 
 class LMAFrame( ):
 
-    def __init__( self, statusPacket, inputArray=None ):
+    def __init__( self, statusPacket, inputArray=None, columns=None, loader=None ):
+        """
+        statusPacket = the StatusPacket at the end of this frame
+        inputArray   = structured numpy array with frameDtype (or compactFrameDtype).  This is not copied, 
+                       so it can be a view (of a memmap, say).  It stays a view 
+                       until something that changes the data happens
+        columns      = instead of inputArray, a dict of separate nano, power, and 
+                       aboveThresh arrays (from a PeakFile, say).  These are views too, 
+                       and are only put together into an array if the data changes
+        loader       = instead of inputArray, a function that returns it.  This is 
+                       called the first time the data is used
+        """
         self.statusPacket = statusPacket
 
         #copy a bunch of the statusPacket attributes over
@@ -323,31 +907,119 @@ class LMAFrame( ):
             #something has gone wrong
             warnings.warn( 'LMAFrame - epoch for frame set to value before LMA was invented')
         
-        #protype attributes
-        self.nano = None
-        self.power = None
-        self.aboveThresh = None
-
+        #the data lives in _buf, which can be bigger than the frame
+        #_n is how much of it is actually used.  _arr is _buf[:_n]
         #the defaults to None if no inputArray given
         self._arr = inputArray
+        self._columns = columns
+        self._loader  = loader
+
+    def _load( self ):
+        #decode lazy frames the first time they're used
+        if self._loader is not None:
+            loader = self._loader
+            self._loader = None
+            self._arr = loader()
+
+    @property
+    def _arr( self ):
+        self._load()
+        if self._buf is None: return None
+        return self._buf[:self._n]
+
+    @_arr.setter
+    def _arr( self, value ):
+        self._buf = value
+        self._n   = 0 if value is None else len( value )
+
+    #the views are made when they're asked for, so they're never stale
+    @property
+    def nano( self ):
+        return self._column( 'nano' )
+
+    @property
+    def power( self ):
+        return self._column( 'power' )
+
+    @property
+    def aboveThresh( self ):
+        return self._column( 'aboveThresh' )
+
+    @property
+    def compact( self ):
+        """
+        True if the peaks are stored with compactFrameDtype
+        """
+        self._load()
+        return self._buf is not None and 'maxData' in self._buf.dtype.names
+
+    def _column( self, name ):
+        #columns are used as they are
+        if self._columns is not None:
+            return self._columns[ name ]
+        self._load()
+        if self._buf is None: return None
+        if name == 'power' and self.compact:
+            #this one's not a view, it's looked up
+            return powerTable[ self._buf['maxData'][:self._n] ]
+        return self._buf[ name ][:self._n]
+
+    def __len__( self ):
+        if self._columns is not None:
+            return len( self._columns['nano'] )
+        self._load()
+        return self._n
 
-        self.update()
-    
     def append( self, nano, power, aboveThresh, update=True ):
         """
+        Add a single peak to the end of the frame
+        update is ignored, the views are always up to date
         """
-        #initialize underlying array
-        if self._arr is None:
-            self._arr = np.empty( 0, dtype=frameDtype )
-        
-        #appending is done by extending the array 1 element, and 
-        #then shoving the new data in at the end.  
-        #doing it this way does not require the _arr to be copied
-        N = len( self._arr )
-        self._arr.resize( (N+1,), refcheck=False )
-        self._arr[N] = nano,power,aboveThresh
+        self.extend( [nano], [power], [aboveThresh] )
 
-        if update: self.update()
+    def extend( self, nano, power, aboveThresh ):
+        """
+        Add arrays of peaks to the end of the frame
+
+        The underlying buffer doubles in size when it runs out of room, 
+        so adding a lot of peaks a few at a time is still linear
+        """
+        nano        = np.atleast_1d( nano )
+        power       = np.atleast_1d( power )
+        aboveThresh = np.atleast_1d( aboveThresh )
+        M = len( nano )
+        if len( power ) != M or len( aboveThresh ) != M:
+            raise Exception( 'LMAFrame.extend - nano, power, and aboveThresh must be the same length' )
+
+        self._join_columns()
+        self._load()
+        if self._buf is None:
+            self._buf = np.empty( 0, dtype=frameDtype )
+            self._n   = 0
+        N = self._n
+        if N+M > len( self._buf ) or not self._buf.flags.owndata or not self._buf.flags.writeable:
+            #out of room, or this is a view of someone else's data that 
+            #we can't grow in place.  Either way, get a new buffer
+            buf = np.empty( max( 2*len( self._buf ), N+M, 16 ), dtype=self._buf.dtype )
+            buf[:N] = self._buf[:N]
+            self._buf = buf
+
+        self._buf['nano'][N:N+M]        = nano
+        if self.compact:
+            #back to the 8 bit value the power came from
+            self._buf['maxData'][N:N+M] = np.clip( np.round( (power+111.0)/0.488 ), 0, 255 )
+        else:
+            self._buf['power'][N:N+M]   = power
+        self._buf['aboveThresh'][N:N+M] = aboveThresh
+        self._n = N+M
+
+    def trim( self ):
+        """
+        Release the unused part of the buffer left over from extend
+        """
+        self._load()
+        if self._buf is not None and len( self._buf ) > self._n:
+            self._buf = self._buf[:self._n].copy()
 
     def copy( self, inplace=True ):
         """
@@ -355,51 +1027,72 @@ class LMAFrame( ):
         sometimes you don't have a copy of stuff in memory when you think you do
         Use this method to force the issue.  Can be done in-place
         """
+        self._join_columns()
         if inplace:
             self._arr = self._arr.copy()
-            self.update()
         else:
             frame = LMAFrame( self.statusPacket, inputArray=self._arr.copy() )
             return frame
 
-    def decimate( self, windowLength ):
-        _arr = np.empty( 0, dtype=frameDtype )
+    def decimate( self, windowLength, topK=1, quantile=None ):
+        """
+        Keep only the highest power peak in each windowLength (ns) window of the second
 
-        nano = 0
-        i = 0
-        N = 0
-        while nano+windowLength < 1e9 and i < len( self._arr ):
-            #skip forward?  Data is unevenly distributed
-            if self._arr['nano'][i] >= nano+windowLength:
-                nano += windowLength
-                continue
-            #inside this window, find the max sample
-            maxPeak = self._arr[i]
-            while self._arr['nano'][i] < nano+windowLength:
-                #we keep the highest power peak each time
-                if self._arr['power'][i] > maxPeak['power']:
-                    maxPeak = self._arr[i]
-                i += 1
-                #for the last window, we might run off the end of the array
-                #don't
-                if i >= len( self._arr ): break
-            #append the maxPeak to the new array
-            _arr.resize( (N+1,), refcheck=False )
-            _arr[N] = maxPeak
-            N += 1
+        topK     - keep this many of the highest power peaks in each window instead
+        quantile - keep the peaks with power above this quantile (0-1) of the powers 
+                   in their window, instead of a fixed number.  The highest power 
+                   peak in the window is always kept
+        """
+        self._join_columns()
+        nano  = self._arr['nano'].astype( 'i8' )
+        power = self.power
+        N     = len( self._arr )
+
+        #bin the peaks into windows.  The data should be time ordered, but if it's 
+        #not, out of order peaks go in the window of the latest peak before them
+        window = np.maximum( np.maximum.accumulate( nano ), 0 ) // windowLength if N > 0 else nano
+
+        #sort by window, and then by power (highest first) inside the window
+        #ties go to the earlier peak
+        order = np.lexsort( ( np.arange( N ), -power, window ) )
+        sortedWindow = window[ order ]
+        #where each window starts in the sorted array
+        windowStarts = np.flatnonzero( np.concatenate( [[True], sortedWindow[1:] != sortedWindow[:-1]] ) ) if N > 0 else np.empty( 0, dtype='i8' )
+        windowCounts = np.diff( np.concatenate( [windowStarts, [N]] ) )
+        #rank of each peak in it's window, 0 is the highest power
+        rank = np.arange( N ) - np.repeat( windowStarts, windowCounts )
+
+        #how many peaks to keep in each window
+        if quantile is None:
+            nKeep = topK
+        else:
+            nKeep = np.repeat( np.maximum( np.ceil( (1-quantile)*windowCounts ), 1 ), windowCounts )
+
+        keep = np.zeros( N, dtype='bool' )
+        keep[ order[ rank < nKeep ] ] = True
+        #the last window doesn't fit in the second, so it's left off
+        keep &= window*windowLength + windowLength < 1e9
 
         #apply the new _arr to self, this destroys the old _arr
-        self._arr = _arr
-        self.update()
+        self._arr = self._arr[ keep ]
+
+    def _join_columns( self ):
+        """
+        If this frame was made from columns, put them together into the _arr
+        This makes a copy, so it only happens when we need to change stuff
+        """
+        if self._columns is None: return
+        self._arr = np.empty( len( self._columns['nano'] ), dtype=frameDtype )
+        for name in self._arr.dtype.names:
+            self._arr[ name ] = self._columns[ name ]
+        self._columns = None
 
     def update( self ):
         """
+        Does nothing now, the nano, power, and aboveThresh views are made 
+        when they're used.  Kept around for older code that calls it
         """
-        #make sure we have something to update
-        if self._arr is None: return
-        self.nano        = self._arr['nano'][:]
-        self.power       = self._arr['power'][:]
-        self.aboveThresh = self._arr['aboveThresh'][:]
+        pass
 
 class StatusPacket:
 
@@ -418,7 +1111,8 @@ class StatusPacket:
 
         self.inputString = inputString
         #decode the words
-        self.words = struct.unpack( '<9h', inputString )
+        #v8/9 status packets are only 12 bytes, so this might be given 6 words
+        self.words = struct.unpack( '<%ih'%(len(inputString)//2), inputString )
 
         #v8/9 status messages only have 6 words
         #v10+ status messages have 9 words to add in phase and gps information
@@ -466,10 +1160,10 @@ class StatusPacket:
     def calc_epoch( self ):
         #it's surprisingly annoying converting from numerical values for
         #year/month/day into an epoch
-        #the easiest way to do it is to convert to a string, and then back
-        #because of course that's what you need to do
-        timestamp = '%i%02i%02iT%02i:%02i:%02i'%(self.year, self.month, self.day, self.hour, self.minute, self.second)
-        self.epoch = timestamp2epoch( timestamp )
+        #this used to go through a string and strptime, now it's integer math
+        if not valid_civil( self.year, self.month, self.day, self.hour, self.minute, self.second ):
+            raise Exception( 'Malformed status packet has invalid timestamp' )
+        self.epoch = civil2epoch( self.year, self.month, self.day, self.hour, self.minute, self.second )
 
     def decode( self ):
         #the various decode methods all look very similar, since changes 
@@ -478,7 +1172,9 @@ class StatusPacket:
         #that's for the better, as it issolates the decoding used for each 
         #version, without muddying the situation with share methods for the 
         #sake of sharing.  
-        if self.version == 10 or self.version == 11:
+        if self.version == 8 or self.version == 9:
+            self.decode_89()
+        elif self.version == 10 or self.version == 11:
             self.decode_1011()
         elif self.version == 12 or self.version == 13:
             self.decode_1213()
@@ -505,8 +1201,13 @@ class StatusPacket:
         #the ID ought to be a char but I'm not sure how Rison excoded it
         #will need example file to sort it out
         #TODO - sort out character encoding
+        #for now, assume it's offset by 64 the same as v10+
         self.id           = (self.words[4]>>8)&0x7F
+        self.id           = chr(self.id+64)
+        self.netid        = ''
         self.track        = (self.words[5]>>12)&0xF  #I'm not sure what this is
+        #no GPS information in v8/9
+        self.gpsInfo      = 0
 
     def decode_1011( self ):
         #reference data_format_v12.pdf
@@ -602,6 +1303,10 @@ class DataPacket:
         """
         if self.version == 12 or self.version==10:
             self.decode_12()
+        elif self.version == 8:
+            self.decode_8()
+        elif self.version == 9:
+            self.decode_9()
 
     def decode_8( self ):
         #even version numbers are for 80us
@@ -674,6 +1379,257 @@ class DataPacket:
         #convert maxData to power in dBm
         self.power       = 0.488*self.maxData -111.0
 
+def decode_data_packets( words, version, phaseDiff=0, compact=False ):
+    """
+    Decodes a whole block of data packets at once.  This does the same thing as
+    DataPacket, but using array operations instead of 1 packet at a time
+
+    words     - int16 numpy array of data words, 3 words per data packet
+    version   - raw data version, from the status packet
+    phaseDiff - from the status packet, needed for good timing
+    compact   - decode to compactFrameDtype instead
+
+    returns a structured numpy array with frameDtype (or compactFrameDtype)
+    """
+    words = words.reshape( -1, 3 )
+
+    #the data packet should be +, -, +
+    pattern = (words[:,0] >= 0) & (words[:,1] < 0) & (words[:,2] >= 0)
+    if not pattern.all():
+        raise Exception( "Malformed data packet doesn't follow bit pattern" )
+
+    dataArray = np.empty( len(words), dtype=compactFrameDtype if compact else frameDtype )
+
+    if version == 12 or version == 10:
+        #see DataPacket.decode_12 for what all this means
+        samplePeriod = 1e9/( 25000000 + phaseDiff )    #in ns
+        windowLength = 80000    #80us
+
+        w0 = words[:,0].astype( 'i8' )
+        w1 = words[:,1].astype( 'i8' )
+        w2 = words[:,2].astype( 'i8' )
+
+        aboveThresh = (w0 >> 11) | ( (w2&0xFF00)>>4 )
+        ticks       = (w0 & 0x07FF)
+        window      = (w1 & 0x3FFF)
+        maxData     = (w2 & 0x00FF)
+
+        #the int() in DataPacket truncates, so does astype
+        dataArray['nano']        = window*windowLength + (ticks*samplePeriod).astype( 'i8' )
+        if compact:
+            dataArray['maxData'] = maxData
+        else:
+            dataArray['power']   = 0.488*maxData -111.0
+        dataArray['aboveThresh'] = aboveThresh
+    elif version == 8 or version == 9:
+        #see DataPacket.decode_8 and decode_9
+        #these still had the phase locked loop, so phaseDiff isn't used
+        samplePeriod = 1e9/25000000
+
+        w0 = words[:,0].astype( 'i8' )
+        w1 = words[:,1].astype( 'i8' )
+        w2 = words[:,2].astype( 'i8' )
+
+        aboveThresh = (w0 >> 11) | ((w1&0x4000)>>10) | ((w2&0x7F00)>>4)
+        maxData     = (w2 & 0x00FF)
+        if version == 8:
+            windowLength = 80000    #80us
+            ticks        = (w0 & 0x07FF)
+            window       = (w1 & 0x3FFF)
+        else:
+            windowLength = 10000    #10us
+            ticks        = (w0 & 0x00FF)
+            window       = (w1 & 0x3FFF) | (w0 &0x0700)<<6
+
+        dataArray['nano']        = window*windowLength + (ticks*samplePeriod).astype( 'i8' )
+        if compact:
+            dataArray['maxData'] = maxData
+        else:
+            dataArray['power']   = 0.488*maxData -111.0
+        dataArray['aboveThresh'] = aboveThresh
+    else:
+        raise Exception( 'Unknown raw data version %i'%version )
+
+    return dataArray
+
+def decode_frame_block( block, frameStarts, triggerCounts, phaseDiffs, version, compact=False ):
+    """
+    Decodes the data packets for a bunch of frames that were read in one block
+
+    block         - uint8 numpy array of the bytes read from the file
+    frameStarts   - where each frame's data packets start in the block
+    triggerCounts - number of data packets in each frame
+    phaseDiffs    - phaseDiff from the status packet of each frame
+    version       - raw data version
+    compact       - decode to compactFrameDtype instead
+
+    returns a structured numpy array with frameDtype, with all the frames one after another
+    """
+    #pull all the data packets out from between the status packets
+    #the data array is 3 words per data packet
+    packetStarts = expand_ranges( frameStarts, triggerCounts, 6 )
+    words = block[ packetStarts[:,None] + np.arange( 6 ) ].view( '<i2' )
+    return decode_data_packets( words, version=version, phaseDiff=np.repeat( phaseDiffs, triggerCounts ), compact=compact )
+
+def decode_gps_slots( epochs, gpsInfo ):
+    """
+    The GPS information is sent 16 bits at a time in the status packets, and 
+    which bits get sent depends on the second in a 12 second cycle.  This finds 
+    the latest value sent for each of the 12 slots, at every status packet
+      0/1  - lat, high and low 16 bits      6/7 - vel, high and low 16 bits
+      2/3  - lon, high and low 16 bits      8   - brg
+      4/5  - alt, high and low 16 bits      9   - satellites tracked/visible
+      10   - satellite status               11  - temperature
+
+    epochs  - epoch of each status packet
+    gpsInfo - gpsInfo of each status packet
+
+    returns ( values, seen ), both shaped ( len(epochs), 12 ).  seen is False 
+    for slots that haven't been sent yet, and those values are 0
+    """
+    epochs  = np.asarray( epochs, dtype='i8' )
+    gpsInfo = np.asarray( gpsInfo, dtype='i8' )
+    rows = np.arange( len( epochs ) )
+    #epochs don't have leap seconds, so this is the GPS second
+    slots = epochs%12
+    #the row of the latest status packet for each slot, -1 if there hasn't been one
+    latest = np.where( slots[:,None] == np.arange( 12 ), rows[:,None], -1 )
+    latest = np.maximum.accumulate( latest, axis=0 ) if len( rows ) > 0 else latest
+    seen   = latest >= 0
+    values = np.where( seen, gpsInfo[ np.maximum( latest, 0 ) ], 0 )
+    return values, seen
+
+def decode_gps_track( epochs, gpsInfo, perCycle=False ):
+    """
+    Turns the GPS information from a bunch of status packets into a time series
+    Values that haven't been sent (completely) yet are nan
+
+    epochs   - epoch of each status packet
+    gpsInfo  - gpsInfo of each status packet
+    perCycle - [bool] - one row per 12 second cycle instead of one per status packet
+
+    returns a structured numpy array with gpsTrackDtype
+    """
+    epochs = np.asarray( epochs, dtype='i8' )
+    values, seen = decode_gps_slots( epochs, gpsInfo )
+
+    def join( hi, lo ):
+        #the 32 bit values, and if we've seen both halves of them
+        return (values[:,hi]<<16) | values[:,lo], seen[:,hi] & seen[:,lo]
+
+    def latlon( gpsInt ):
+        #see RawLMAFile.convert_latlon
+        gpsInt = np.where( gpsInt>>31 == 1, gpsInt - (1<<32), gpsInt )
+        return gpsInt*90/324000000.0
+
+    track = np.empty( len( epochs ), dtype=gpsTrackDtype )
+    track['epoch'] = epochs
+    gpslat, ok = join( 0, 1 )
+    track['lat'] = np.where( ok, latlon( gpslat ), np.nan )
+    gpslon, ok = join( 2, 3 )
+    track['lon'] = np.where( ok, latlon( gpslon ), np.nan )
+    gpsalt, ok = join( 4, 5 )
+    track['alt'] = np.where( ok, gpsalt/100.0, np.nan )
+    vel, ok = join( 6, 7 )
+    track['vel'] = np.where( ok, vel, np.nan )
+    track['brg']        = np.where( seen[:,8], values[:,8], np.nan )
+    track['satTracked'] = np.where( seen[:,9], (values[:,9]>>8) &0xFF, np.nan )
+    track['satVisible'] = np.where( seen[:,9], values[:,9] &0xFF, np.nan )
+    track['satStat']    = np.where( seen[:,10], values[:,10] &0xFFF, np.nan )
+    track['temp']       = np.where( seen[:,11], (values[:,11]>>8)-40, np.nan )
+
+    if perCycle and len( epochs ) > 0:
+        #the last status packet in each cycle has everything for that cycle
+        cycles = epochs//12
+        last   = np.flatnonzero( np.concatenate( [cycles[1:] != cycles[:-1], [True]] ) )
+        track  = track[ last ]
+        track['epoch'] = cycles[ last ]*12
+
+    return track
+
+def check_status_packets( statusWords, version ):
+    """
+    Tests if each row of statusWords looks like a real status packet of the given version.
+    This is what StatusPacket checks by throwing exceptions, but for a whole bunch 
+    of possible status packets at once
+
+    returns a boolean array, 1 value per row
+    """
+    words = statusWords.astype( 'i8' )
+    #all words in the status packets are negative
+    valid = (words < 0).all( axis=1 )
+    valid &= (words[:,0]>>7) &0x3f == version
+    #the timestamp should make sense
+    second       = (words[:,2]>>6 )&0x3F
+    minute       =  words[:,2] &0x3F
+    hour         = (words[:,3]>>9)&0x1F
+    day          = (words[:,3]>>4)&0x1F
+    month        =  words[:,3] &0x0F
+    year         = (words[:,0] &0x7F) + 2000
+    valid &= valid_civil( year, month, day, hour, minute, second )
+    return valid
+
+def status_id_bits( statusWords, version ):
+    """
+    The bits of the status words that hold the station and network id
+    These should be the same for every status packet in a file
+    (v8-11 don't have a network id)
+    """
+    if version < 10:
+        #v8/9 have the id in word 4, and word 1 is used for the phase count
+        return np.stack( [statusWords[:,4]&0x7F00, np.zeros_like( statusWords[:,4] )], axis=1 )
+    netidMask = 0x7FFF if version >= 12 else 0x7F00
+    return np.stack( [statusWords[:,1]&0x1000, statusWords[:,5]&netidMask], axis=1 )
+
+def decode_status_packets( statusWords, version, statusLocations=None ):
+    """
+    Decodes a whole bunch of status packets at once.  This does the same thing as 
+    StatusPacket, but with array operations, and only keeps the fields in statusDtype
+
+    statusWords     - int16 numpy array of status words, 1 row per status packet
+    version         - raw data version, from the first status packet
+    statusLocations - file locations of the status packets
+
+    returns a structured numpy array with statusDtype
+    """
+    words = statusWords.astype( 'i8' )
+
+    statusArray = np.zeros( len(words), dtype=statusDtype )
+    if statusLocations is not None:
+        statusArray['location'] = statusLocations
+    if len( words ) == 0:
+        return statusArray
+
+    if version < 8 or version > 13:
+        raise Exception( 'Unknown raw data version %i'%version )
+    if not check_status_packets( words, version ).all():
+        raise Exception( "Malformed status packet doesn't follow bit pattern" )
+
+    #see StatusPacket.decode_1213 for what all this means, 
+    #v10/11 are the same for everything we keep here, and v8/9 for the timestamp
+    year         = (words[:,0] &0x7F) + 2000
+    second       = (words[:,2]>>6 )&0x3F
+    minute       =  words[:,2] &0x3F
+    hour         = (words[:,3]>>9)&0x1F
+    day          = (words[:,3]>>4)&0x1F
+    month        =  words[:,3] &0x0F
+
+    statusArray['epoch']        = civil2epoch( year, month, day, hour, minute, second )
+    statusArray['threshold']    =  words[:,1] &0xFF
+    statusArray['fifoStatus']   = (words[:,2]>>12)&0x07
+    #sign bit stored elsewhere
+    phaseSign = np.where( (words[:,1]>>14)&0x1 == 1, -1, 1 )
+    if version < 10:
+        #see StatusPacket.decode_89, there's no GPS information
+        statusArray['triggerCount'] = (words[:,5]&0x1FF) | (words[:,4]&0x7F)<<9
+        statusArray['phaseDiff']    = ((words[:,1]>>8)&0x1F) * phaseSign
+        return statusArray
+    statusArray['triggerCount'] =  words[:,4] &0x3FFF
+    statusArray['phaseDiff']    = (words[:,6] &0x7FFF) * phaseSign
+    statusArray['gpsInfo']      = (words[:,7] &0x7FFF) | (words[:,1]&0x2000)<<2
+
+    return statusArray
+
 class Station:
     """
     Holder for information about a station or network
@@ -722,6 +1678,8 @@ class LocFile:
 
         self.sensors = {}
         self.network = None
+        #made by sensor_table when it's needed
+        self._sensorTable = None
 
         if self.inputPath != None:
             self.read()
@@ -739,6 +1697,7 @@ class LocFile:
 
         #we need to read stationInfo in a loop
         self.sensors = {}
+        self._sensorTable = None
         while True:
             #doing this is a try block is pretty janky, but will probably work
             try:
@@ -801,9 +1760,29 @@ class LocFile:
 
     def add( self, station ):
         self.sensors[ station.id ] = station 
+        self._sensorTable = None
+
+    def sensor_table( self ):
+        """
+        Dense arrays of the sensor locations and delays, indexed by the ord of 
+        the sensor id (the sensor byte in Phasor.sortedPeaks)
+
+        returns cartesian, delay
+            cartesian - (256,3) array, nan for ids that aren't in the file
+            delay     - (256,) array of cable delays, nan for ids that aren't in the file
+        The table is remade after add, so add a station again if it changes
+        """
+        if self._sensorTable is None:
+            cartesian = np.full( [256,3], np.nan )
+            delay     = np.full( 256, np.nan )
+            for id, station in self.sensors.items():
+                if station.cartesian is not None:
+                    cartesian[ ord( id ) ] = station.cartesian
+                delay[ ord( id ) ] = station.delay if station.delay is not None else 0
+            self._sensorTable = cartesian, delay
+        return self._sensorTable
 
     def write(self, outputPath=None):
-        #TODO - should implement this
         #set the inputPath
         if outputPath==None:
             #write to the same place we read from, this is actually dangerous and will 
@@ -813,6 +1792,384 @@ class LocFile:
         if outputPath==None:
             #if it's still None, we have nothing to write
             raise Exception( 'LocFile.write - No outputPath to write to')
+        if self.network is None:
+            raise Exception( 'LocFile.write - No network information to write')
+
+        #same serial format that read uses, 1 parameter per line
+        #no blank lines, read doesn't like them
+        filePointer = open( outputPath, 'w' )
+        filePointer.write( '%s\n%r\n%r\n%r\n'%( (self.network.name,) + tuple( float(v) for v in self.network.geodetic ) ) )
+        for id, station in self.sensors.items():
+            if station.geodetic is None:
+                #a station added from a frame without a GPS fix, there's no location to write
+                warnings.warn( 'LocFile.write - station %s has no location, it was not written'%id )
+                continue
+            filePointer.write( '%s\n%s\n%r\n%r\n%r\n%r\n%i\n%i\n'%( (station.name, id) + tuple( float(v) for v in station.geodetic ) + 
+                               (float( station.delay or 0 ), station.boardVersion or 0, station.channel or 0) ) )
+        filePointer.close()
+
+def write_peak_file( lmaFile, outputPath=None, chunk_seconds=10 ):
+    """
+    Decode a whole RawLMAFile, and save it as a PeakFile, so it never needs to 
+    be decoded again.  See PeakFile for the format
+
+    lmaFile    - the RawLMAFile
+    outputPath - directory to make, defaults to the raw file path + .peaks
+
+    returns the outputPath
+    """
+    if outputPath is None:
+        outputPath = lmaFile.inputPath + '.peaks'
+
+    #write to a temporary directory and then move it, 
+    #so nobody can read a half written PeakFile
+    tmpPath = outputPath + '.%i.tmp'%os.getpid()
+    os.makedirs( tmpPath )
+
+    #the per frame stuff
+    triggerCounts = lmaFile.trigger_counts()
+    frameOffsets  = np.concatenate( [[0], np.cumsum( triggerCounts )] ).astype( 'i8' )
+    np.save( os.path.join( tmpPath, 'frameOffsets.npy' ), frameOffsets )
+    np.save( os.path.join( tmpPath, 'statusIndex.npy' ), lmaFile.statusIndex )
+    np.save( os.path.join( tmpPath, 'statusWords.npy' ), lmaFile._read_status_words( lmaFile.statusLocations ) )
+
+    #the peaks, one column at a time
+    columns = {}
+    for name, dtype in frameDtype:
+        columns[name] = np.lib.format.open_memmap( os.path.join( tmpPath, name+'.npy' ), mode='w+', dtype=dtype, shape=(int(frameOffsets[-1]),) )
+    nStatus = len( lmaFile.statusLocations )
+    for iStart in range( 1, nStatus, chunk_seconds ):
+        iStop  = min( iStart+chunk_seconds, nStatus )
+        frames = lmaFile.read_frames( iStart, iStop )
+        for name in columns:
+            columns[name][ frameOffsets[iStart-1]:frameOffsets[iStop-1] ] = np.concatenate( [getattr( frame, name ) for frame in frames] )
+    for name in columns:
+        columns[name].flush()
+    del columns
+
+    #everything else about the file
+    header = { 'sourcePath':os.path.abspath( lmaFile.inputPath ), 'decimated':lmaFile.decimated }
+    for attribute in RawLMAFile._cacheAttributes:
+        if hasattr( lmaFile, attribute ):
+            value = getattr( lmaFile, attribute )
+            #json doesn't know about arrays (idBits)
+            header[ attribute ] = value.tolist() if isinstance( value, np.ndarray ) else value
+    with open( os.path.join( tmpPath, 'header.json' ), 'w' ) as headerFile:
+        json.dump( header, headerFile, indent=1 )
+
+    if os.path.exists( outputPath ):
+        shutil.rmtree( outputPath )
+    os.rename( tmpPath, outputPath )
+    return outputPath
+
+class PeakFile:
+    """
+    Decoded LMA peaks, saved in a columnar format that can be memory mapped
+    This has the same frame API as RawLMAFile (read_frame, read_frames, iter_frames, 
+    frameEpochs, statusIndex, ...), but the frames are slices of the saved columns, 
+    nothing gets decoded
+
+    A PeakFile is a directory (made by write_peak_file) with:
+      nano.npy, power.npy, aboveThresh.npy - all the peaks in the file, frame after frame
+      frameOffsets.npy - the peaks for frame i are [ frameOffsets[i-1]:frameOffsets[i] ]
+      statusIndex.npy  - the RawLMAFile statusIndex
+      statusWords.npy  - the raw status packets, so we can make StatusPackets for the frames
+      header.json      - version, id, location, and other information from the RawLMAFile
+    """
+
+    def __init__( self, inputPath ):
+        """
+        inputPath = path to the PeakFile directory
+        """
+        self.inputPath = inputPath
+        if not os.path.isdir( self.inputPath ):
+            raise Exception( 'PeakFile.__init__: inputPath does not exist: %s'%self.inputPath )
+
+        with open( os.path.join( self.inputPath, 'header.json' ) ) as headerFile:
+            header = json.load( headerFile )
+        for attribute in header:
+            setattr( self, attribute, header[attribute] )
+
+        self.frameOffsets = np.load( os.path.join( self.inputPath, 'frameOffsets.npy' ) )
+        self.statusIndex  = np.load( os.path.join( self.inputPath, 'statusIndex.npy' ) )
+        self.statusWords  = np.load( os.path.join( self.inputPath, 'statusWords.npy' ) )
+        self.statusLocations = self.statusIndex['location']
+        self.frameEpochs  = FrameEpochs( self.statusIndex['epoch'][1:], offset=1 )
+
+        #the peaks are memory mapped, they're only read when they're used
+        self.columns = {}
+        for name, dtype in frameDtype:
+            self.columns[name] = np.load( os.path.join( self.inputPath, name+'.npy' ), mmap_mode='r' )
+
+        #finalize location stuff, the same way RawLMAFile does
+        if self.lat !=0 and self.lon != 0 and self.alt != 0:
+            self.geodetic  = self.lat, self.lon, self.alt
+            self.cartesian = latlonalt2xyz( *self.geodetic )
+        else:
+            self.geodetic  = None
+            self.cartesian = None
+
+    def close( self ):
+        self.columns = {}
+
+    def read_frame( self, iStatus ):
+        """
+        Get the peaks associated with the ith status message
+
+        returns an LMAFrame
+        """
+        if iStatus <= 0 or iStatus >= len(self.statusLocations) :
+            raise Exception( "Can't read the %ith collection of data, choose number between 1 and %i"%(iStatus, len(self.statusLocations)-1) )
+
+        return self.read_frames( iStatus, iStatus+1 )[0]
+
+    def read_frames( self, iStart, iStop ):
+        """
+        Get frames iStart to iStop-1
+
+        returns a list of LMAFrames, their data are views of the memory mapped columns
+        """
+        if iStart <= 0 or iStop > len(self.statusLocations) or iStart >= iStop:
+            raise Exception( "Can't read collections %i to %i of data, choose numbers between 1 and %i"%(iStart, iStop-1, len(self.statusLocations)-1) )
+
+        frames = []
+        for iFrame in range( iStart, iStop ):
+            statusPacket = StatusPacket( self.statusWords[iFrame].tobytes() )
+            statusPacket.geodetic  = self.geodetic
+            statusPacket.cartesian = self.cartesian
+            i0, i1 = self.frameOffsets[iFrame-1], self.frameOffsets[iFrame]
+            columns = { name: self.columns[name][i0:i1] for name in self.columns }
+            frames.append( LMAFrame( statusPacket, columns=columns ) )
+        return frames
+
+    #picking frames by epoch works exactly the same way as it does for the raw file
+    iter_frames = RawLMAFile.iter_frames
+    gps_track   = RawLMAFile.gps_track
+
+def decode_archive( inputPaths, workers=None, outputDir=None, framesPerTask=60, **fileOptions ):
+    """
+    Decodes every frame of every file in inputPaths, using a pool of processes
+
+    The work is split up into chunks of frames, and each worker writes its decoded 
+    peaks straight into a memory mapped .npy file for the input file, so nothing 
+    big gets pickled back and forth between processes
+
+    inputPaths    - list of raw data files
+    workers       - number of processes, defaults to the number of cpus
+    outputDir     - where the .npy files go.  If None a temporary directory is made, 
+                    and it's up to you to clean it up
+    framesPerTask - number of frames decoded by a worker at once
+    fileOptions   - passed along to RawLMAFile (decimated, cache, ...)
+
+    returns a dict {inputPath: (peaks, frameOffsets)}
+    peaks is a read only memmap of all the decoded peaks in the file (frameDtype), 
+    and the peaks for frame i are peaks[ frameOffsets[i-1]:frameOffsets[i] ], 
+    the same way the data for frame i is between statusLocations[i-1] and statusLocations[i]
+    """
+    if outputDir is None:
+        outputDir = tempfile.mkdtemp( prefix='lmadecode' )
+    elif not os.path.exists( outputDir ):
+        os.makedirs( outputDir )
+
+    #we need the status index for all the files, that's quick
+    with ThreadPoolExecutor( max_workers=workers ) as pool:
+        lmaFiles = list( pool.map( lambda inputPath: RawLMAFile( inputPath, **fileOptions ), inputPaths ) )
+
+    results = {}
+    tasks   = []
+    for iFile, lmaFile in enumerate( lmaFiles ):
+        #find out where each frame's peaks go in the output
+        triggerCounts = lmaFile.trigger_counts()
+        frameOffsets  = np.concatenate( [[0], np.cumsum( triggerCounts )] ).astype( 'i8' )
+
+        #files can have the same name in different directories
+        outputPath = os.path.join( outputDir, '%04i_%s.npy'%(iFile, os.path.basename( lmaFile.inputPath ) ) )
+        peaks = np.lib.format.open_memmap( outputPath, mode='w+', dtype=frameDtype, shape=(int(frameOffsets[-1]),) )
+        del peaks   #this makes sure the header is written before the workers get to it
+        results[ lmaFile.inputPath ] = outputPath, frameOffsets
+
+        #split the file into tasks
+        #compressed files are done in 1 task, so they're only decompressed once
+        #the worker gets the checkpoints from here, so it doesn't have to make its own
+        nStatus = len( lmaFile.statusLocations )
+        framesPerFileTask = nStatus if lmaFile.compressed else framesPerTask
+        index = lmaFile.inputFile.get_index() if lmaFile.compressed else None
+        for iStart in range( 1, nStatus, framesPerFileTask ):
+            iStop = min( iStart+framesPerFileTask, nStatus )
+            tasks.append( ( lmaFile.inputPath, index, outputPath, int( frameOffsets[iStart-1] ), lmaFile.version, 
+                            lmaFile.statusLocations[iStart-1:iStop], lmaFile.statusSize,
+                            triggerCounts[iStart-1:iStop-1], lmaFile.statusIndex['phaseDiff'][iStart:iStop], framesPerTask ) )
+        #we don't need the file open in this process anymore
+        lmaFile.close()
+
+    with ProcessPoolExecutor( max_workers=workers ) as pool:
+        #list makes sure any exceptions in the workers get raised here
+        list( pool.map( _decode_archive_task, tasks ) )
+
+    return { inputPath: ( np.load( outputPath, mmap_mode='r' ), frameOffsets ) for inputPath, (outputPath, frameOffsets) in results.items() }
+
+def _decode_archive_task( task ):
+    """
+    The part of decode_archive that runs in the worker processes
+    """
+    inputPath, index, outputPath, outputOffset, version, statusLocations, statusSize, triggerCounts, phaseDiffs, framesPerRead = task
+
+    peaks = np.load( outputPath, mmap_mode='r+' )
+    if index is None:
+        inputFile = open( inputPath, 'rb' )
+    else:
+        inputFile = CompressedFile( inputPath, index=index )
+    with inputFile:
+        for iStart in range( 0, len( triggerCounts ), framesPerRead ):
+            iStop = min( iStart+framesPerRead, len( triggerCounts ) )
+            #one read for the whole range of frames
+            readStart = int( statusLocations[iStart] )+statusSize
+            readEnd   = int( statusLocations[iStop] )
+            inputFile.seek( readStart )
+            block = np.frombuffer( inputFile.read( readEnd-readStart ), dtype='u1' )
+
+            dataArray = decode_frame_block( block, statusLocations[iStart:iStop]+statusSize-readStart, 
+                                            triggerCounts[iStart:iStop], phaseDiffs[iStart:iStop], version )
+
+            #write the peaks straight into the output file
+            peaks[ outputOffset:outputOffset+len(dataArray) ] = dataArray
+            outputOffset += len( dataArray )
+    peaks.flush()
+
+class NetworkReader:
+    """
+    Reads the raw data files for a whole network, and lines them up by epoch
+
+    Each station can have a bunch of files (they usually roll over every 10 minutes).
+    The frames for all the stations for an epoch are read at the same time, 
+    in a pool of threads, so reading an epoch takes as long as the slowest station
+    """
+
+    def __init__( self, inputPaths, locFile=None, workers=None, **fileOptions ):
+        """
+        inputPaths  - list of raw data files (or PeakFiles), for any number of stations
+        locFile     - LocFile for the network.  Used to fill in the station locations 
+                      for frames that don't have them (ie, not enough GPS info in the file)
+        workers     - number of threads used for reading, defaults to 1 per station
+        fileOptions - passed along to RawLMAFile (decimated, mmap, cache, ...)
+        """
+        self.inputPaths = inputPaths
+        self.locFile    = locFile
+
+        #opening the files is mostly I/O too, so this is done with threads
+        #PeakFiles (directories) can be mixed in with the raw files
+        def open_file( inputPath ):
+            if os.path.isdir( inputPath ):
+                return PeakFile( inputPath )
+            return RawLMAFile( inputPath, **fileOptions )
+        with ThreadPoolExecutor( max_workers=workers ) as pool:
+            lmaFiles = list( pool.map( open_file, self.inputPaths ) )
+
+        #sort the files out by station, and then by time
+        self.lmaFiles = {}
+        for lmaFile in sorted( lmaFiles, key=lambda lmaFile: lmaFile.startEpoch ):
+            self.lmaFiles.setdefault( lmaFile.id, [] ).append( lmaFile )
+        self.stationIds = sorted( self.lmaFiles )
+
+        #table of which file, and which frame, has each epoch for each station
+        self._frameEpochs  = {}
+        self._fileNumbers  = {}
+        self._frameNumbers = {}
+        allEpochs = []
+        for id in self.stationIds:
+            epochs  = []
+            fileNumbers  = []
+            frameNumbers = []
+            for iFile, lmaFile in enumerate( self.lmaFiles[id] ):
+                #the first status has no data, so there's no frame 0
+                epochs.append( lmaFile.statusIndex['epoch'][1:] )
+                fileNumbers.append( np.full( len(lmaFile.statusIndex)-1, iFile ) )
+                frameNumbers.append( np.arange( 1, len(lmaFile.statusIndex) ) )
+            epochs = np.concatenate( epochs )
+            self._frameEpochs[id]  = FrameEpochs( epochs )
+            self._fileNumbers[id]  = np.concatenate( fileNumbers )
+            self._frameNumbers[id] = np.concatenate( frameNumbers )
+            allEpochs.append( epochs )
+
+        #all the epochs that at least one station has data for
+        if len( allEpochs ) > 0:
+            self.epochs = np.unique( np.concatenate( allEpochs ) )
+        else:
+            self.epochs = np.empty( 0, dtype='i8' )
+        self.startEpoch = int( self.epochs[0] ) if len( self.epochs ) > 0 else 0
+        self.endEpoch   = int( self.epochs[-1] ) if len( self.epochs ) > 0 else 0
+
+        self.pool = ThreadPoolExecutor( max_workers=workers or max( len(self.stationIds), 1 ) )
+
+    def __iter__( self ):
+        return self.iter_epochs()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def close( self ):
+        self.pool.shutdown()
+
+    def _read_frame( self, id, epoch ):
+        #find the frame for this station/epoch
+        i = self._frameEpochs[id].get( epoch )
+        lmaFile = self.lmaFiles[id][ self._fileNumbers[id][i] ]
+        frame = lmaFile.read_frame( int( self._frameNumbers[id][i] ) )
+
+        #the location might not have been in the raw file
+        if frame.geodetic is None and self.locFile is not None and id in self.locFile.sensors:
+            station = self.locFile.sensors[id]
+            frame.geodetic  = frame.statusPacket.geodetic  = station.geodetic
+            frame.cartesian = frame.statusPacket.cartesian = station.cartesian
+        return frame
+
+    def _submit_epoch( self, epoch ):
+        #start reading all the stations with this epoch
+        futures = {}
+        for id in self.stationIds:
+            if epoch in self._frameEpochs[id]:
+                futures[id] = self.pool.submit( self._read_frame, id, epoch )
+        return futures
+
+    def read_epoch( self, epoch ):
+        """
+        Read the frames for all stations for 1 epoch
+
+        returns dict {stationId: LMAFrame}, stations without data for the epoch are left out
+        """
+        futures = self._submit_epoch( epoch )
+        return { id: futures[id].result() for id in futures }
+
+    def iter_epochs( self, start_epoch=None, end_epoch=None ):
+        """
+        Generator that goes through the network epoch by epoch
+        The next epoch is read while the current one is being used
+
+        start_epoch - first epoch to read, defaults to the start of the data
+        end_epoch   - read epochs before this, defaults to the end of the data
+
+        yields dict {stationId: LMAFrame}
+        """
+        epochs = self.epochs
+        if start_epoch is not None:
+            epochs = epochs[ epochs >= start_epoch ]
+        if end_epoch is not None:
+            epochs = epochs[ epochs < end_epoch ]
+
+        futures = None
+        for i in range( len(epochs) ):
+            if futures is None:
+                futures = self._submit_epoch( epochs[i] )
+            #read ahead
+            if i+1 < len( epochs ):
+                nextFutures = self._submit_epoch( epochs[i+1] )
+            else:
+                nextFutures = None
+            yield { id: futures[id].result() for id in futures }
+            futures = nextFutures
 
 if __name__ == '__main__':
     #do a quick test
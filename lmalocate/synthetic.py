@@ -0,0 +1,243 @@
+#!/usr/bin/python
+#
+"""synthetic
+Makes fake LMA data: raw data files (v8, v9, v10, v12) and location files
+This is the reverse of the decoding in raw_io, and is used for benchmarks and
+for trying things out without real data.
+
+The packet layouts are the same ones raw_io decodes, see StatusPacket and
+DataPacket for what all the bits mean.
+"""
+
+import os
+import numpy as np
+#TODO - change to relative imports
+from common import *
+from constants import *
+import raw_io
+
+#the time resolution of the different data versions
+windowLengths = { 8:80000, 9:10000, 10:80000, 11:80000, 12:80000, 13:80000 }
+
+def epoch2civil( epochs ):
+    """
+    The reverse of civil2epoch, for arrays of epochs
+    returns year, month, day, hour, minute, second arrays
+    """
+    t = np.asarray( epochs, dtype='i8' ).astype( 'datetime64[s]' )
+    year  = t.astype( 'datetime64[Y]' ).astype( 'i8' ) + 1970
+    month = t.astype( 'datetime64[M]' ).astype( 'i8' )%12 + 1
+    day   = ( t.astype( 'datetime64[D]' ) - t.astype( 'datetime64[M]' ) ).astype( 'i8' ) + 1
+    secondOfDay = ( t - t.astype( 'datetime64[D]' ) ).astype( 'i8' )
+    return year, month, day, secondOfDay//3600, (secondOfDay//60)%60, secondOfDay%60
+
+def gps_info( epochs, geodetic, vel=0, brg=0, satTracked=9, satVisible=11, satStat=0, temp=25 ):
+    """
+    The gpsInfo sent in the status packet for each epoch.  What gets sent depends
+    on the second, in a 12 second cycle (see raw_io.decode_gps_slots)
+
+    returns an int array of 16 bit values
+    """
+    lat, lon, alt = geodetic
+    #the reverse of RawLMAFile.convert_latlon
+    gpslat = int( round( lat*324000000/90.0 ) ) & 0xFFFFFFFF
+    gpslon = int( round( lon*324000000/90.0 ) ) & 0xFFFFFFFF
+    gpsalt = int( round( alt*100 ) ) & 0xFFFFFFFF
+    vel    = int( vel ) & 0xFFFFFFFF
+    cycle  = np.array( [ gpslat>>16, gpslat&0xFFFF, gpslon>>16, gpslon&0xFFFF,
+                         gpsalt>>16, gpsalt&0xFFFF, vel>>16, vel&0xFFFF,
+                         int( brg )&0xFFFF, (satTracked&0xFF)<<8 | (satVisible&0xFF),
+                         satStat&0xFFF, ((int( temp )+40)&0xFF)<<8 ], dtype='i8' )
+    return cycle[ np.asarray( epochs, dtype='i8' )%12 ]
+
+def encode_status_packets( version, epochs, triggerCounts, id='A', netid='A', threshold=100,
+                           phaseDiffs=0, fifoStatus=0, gpsInfo=0 ):
+    """
+    Makes status packets
+
+    version       - raw data version (8-13)
+    epochs        - epoch of each status packet
+    triggerCounts - number of data packets in the frame before each status packet
+    id            - station id (a letter)
+    netid         - network id, only used for v12/13
+    threshold, phaseDiffs, fifoStatus, gpsInfo - the rest of the status packet,
+                    these can be arrays or numbers
+
+    returns int16 array, 1 row per status packet (9 words, or 6 for v8/9)
+    """
+    epochs = np.asarray( epochs, dtype='i8' )
+    N = len( epochs )
+    year, month, day, hour, minute, second = epoch2civil( epochs )
+    triggerCounts = np.broadcast_to( np.asarray( triggerCounts, dtype='i8' ), (N,) )
+    threshold  = np.broadcast_to( np.asarray( threshold, dtype='i8' ), (N,) )
+    phaseDiffs = np.broadcast_to( np.asarray( phaseDiffs, dtype='i8' ), (N,) )
+    fifoStatus = np.broadcast_to( np.asarray( fifoStatus, dtype='i8' ), (N,) )
+    gpsInfo    = np.broadcast_to( np.asarray( gpsInfo, dtype='i8' ), (N,) )
+    #ids are offset by 64, so A is 1
+    idCode    = ord( id ) - 64
+    netidCode = ord( netid ) - 64 if netid else 0
+    phaseSign = ( phaseDiffs < 0 ).astype( 'i8' )
+
+    if version >= 10:
+        words = np.empty( (N, 9), dtype='i8' )
+        words[:,1] = phaseSign<<14 | ((gpsInfo>>15)&0x1)<<13 | ((idCode>>7)&0x1)<<12 | threshold&0xFF
+        words[:,4] = triggerCounts&0x3FFF
+        words[:,5] = (idCode&0x7F)<<8 | ( netidCode&0xFF if version >= 12 else 0 )
+        words[:,6] = np.abs( phaseDiffs )&0x7FFF
+        words[:,7] = gpsInfo&0x7FFF
+        words[:,8] = 0
+    elif version >= 8:
+        #see StatusPacket.decode_89
+        words = np.empty( (N, 6), dtype='i8' )
+        words[:,1] = phaseSign<<14 | (np.abs( phaseDiffs )&0x1F)<<8 | threshold&0xFF
+        words[:,4] = (idCode&0x7F)<<8 | (triggerCounts>>9)&0x7F
+        words[:,5] = triggerCounts&0x1FF
+    else:
+        raise Exception( 'Unknown raw data version %i'%version )
+    words[:,0] = version<<7 | (year-2000)&0x7F
+    words[:,2] = fifoStatus<<12 | second<<6 | minute
+    words[:,3] = hour<<9 | day<<4 | month
+    #every word of a status packet is negative
+    words |= 0x8000
+    return words.astype( 'u2' ).view( '<i2' )
+
+def encode_data_packets( version, nano, power, aboveThresh=0, phaseDiff=0 ):
+    """
+    Makes data packets
+
+    version     - raw data version (8-13)
+    nano        - time of each peak in the second (ns)
+    power       - power of each peak (dBm)
+    aboveThresh - number of samples above threshold
+    phaseDiff   - from the status packet, only used for v10+
+
+    returns int16 array, 3 words per data packet
+    """
+    nano  = np.asarray( nano, dtype='i8' )
+    power = np.asarray( power, dtype='f8' )
+    aboveThresh = np.broadcast_to( np.asarray( aboveThresh, dtype='i8' ), nano.shape ) & 0x7FF
+    windowLength = windowLengths[ version ]
+    if version >= 10:
+        samplePeriod = 1e9/( 25000000 + phaseDiff )
+    else:
+        samplePeriod = 1e9/25000000
+
+    window  = nano//windowLength
+    ticks   = np.floor( (nano - window*windowLength)/samplePeriod ).astype( 'i8' )
+    ticks   = np.clip( ticks, 0, int( np.ceil( windowLength/samplePeriod ) )-1 )
+    maxData = np.clip( np.round( (power+111.0)/0.488 ), 0, 255 ).astype( 'i8' )
+
+    words = np.empty( (len( nano ), 3), dtype='i8' )
+    if version >= 10:
+        words[:,0] = (aboveThresh&0xF)<<11 | ticks&0x7FF
+        words[:,1] = window&0x3FFF
+        words[:,2] = ((aboveThresh>>4)&0x7F)<<8 | maxData
+    elif version == 8:
+        words[:,0] = (aboveThresh&0xF)<<11 | ticks&0x7FF
+        words[:,1] = ((aboveThresh>>4)&0x1)<<14 | window&0x3FFF
+        words[:,2] = ((aboveThresh>>4)&0x7F)<<8 | maxData
+    elif version == 9:
+        words[:,0] = (aboveThresh&0xF)<<11 | ((window>>14)&0x7)<<8 | ticks&0xFF
+        words[:,1] = ((aboveThresh>>4)&0x1)<<14 | window&0x3FFF
+        words[:,2] = ((aboveThresh>>4)&0x7F)<<8 | maxData
+    else:
+        raise Exception( 'Unknown raw data version %i'%version )
+    #data packets go +, -, +
+    words[:,1] |= 0x8000
+    return words.astype( 'u2' ).view( '<i2' ).ravel()
+
+def random_peaks( rng, triggerRate, windowLength=80000 ):
+    """
+    1 second of noise-like peaks, at most 1 per window like the real thing
+
+    returns nano, power, aboveThresh arrays, in time order
+    """
+    nWindows = int( 1e9//windowLength )
+    N = min( rng.poisson( triggerRate ), nWindows )
+    windows = np.sort( rng.choice( nWindows, N, replace=False ) )
+    nano    = windows*windowLength + rng.integers( 0, windowLength, N )
+    #mostly near the threshold, with a tail of bigger stuff
+    power       = -95.0 + rng.exponential( 6.0, N )
+    aboveThresh = 1 + rng.geometric( 0.2, N )
+    return nano, power, aboveThresh
+
+def decimate_peaks( nano, power, aboveThresh, windowLength ):
+    """
+    Keep the biggest peak in each windowLength, the way real time data is decimated
+    (see LMAFrame.decimate)
+    """
+    nano, power, aboveThresh = np.asarray( nano ), np.asarray( power ), np.asarray( aboveThresh )
+    window = nano//windowLength
+    #highest power first in each window, the first of those if there's a tie
+    order  = np.lexsort( ( np.arange( len( nano ) ), -power, window ) )
+    first  = np.concatenate( [[True], window[order][1:] != window[order][:-1]] ) if len( nano ) > 0 else []
+    keep   = np.sort( order[ first ] )
+    return nano[ keep ], power[ keep ], aboveThresh[ keep ]
+
+def write_raw_file( outputPath, startEpoch, nSeconds=600, triggerRate=1000, version=12,
+                    id='A', netid='A', geodetic=(35.0, -97.0, 400.0), peaks=None,
+                    decimateWindow=None, seed=None ):
+    """
+    Writes a raw data file
+
+    outputPath     - where to write it
+    startEpoch     - epoch of the first status packet, the first frame is the next second
+    nSeconds       - number of frames
+    triggerRate    - average number of random peaks per second
+    version        - raw data version (8, 9, 10, 12)
+    id, netid      - station and network ids
+    geodetic       - station location, for the GPS information in the status packets
+    peaks          - instead of random peaks, a dict {epoch:(nano, power, aboveThresh)}
+                     epochs that aren't in it get empty frames
+    decimateWindow - if set, make a real time file.  Only the biggest peak in each
+                     window is kept, but the triggerCount is for all of them
+    seed           - for the random numbers
+    """
+    rng = np.random.default_rng( seed )
+    windowLength = windowLengths[ version ]
+    epochs = startEpoch + np.arange( nSeconds+1 )
+    phaseDiffs = rng.integers( -200, 200, nSeconds+1 ) if version >= 10 else rng.integers( -20, 20, nSeconds+1 )
+    gpsInfo    = gps_info( epochs, geodetic ) if version >= 10 else 0
+
+    with open( outputPath, 'wb' ) as outputFile:
+        #the first status packet has no frame before it (in this file)
+        statusWords = encode_status_packets( version, epochs, 0, id=id, netid=netid,
+                                             phaseDiffs=phaseDiffs, gpsInfo=gpsInfo )
+        outputFile.write( statusWords[0].tobytes() )
+        for i in range( 1, nSeconds+1 ):
+            if peaks is None:
+                nano, power, aboveThresh = random_peaks( rng, triggerRate, windowLength )
+            elif epochs[i] in peaks:
+                nano, power, aboveThresh = peaks[ epochs[i] ]
+            else:
+                nano, power, aboveThresh = [], [], []
+            triggerCount = len( nano )
+            if decimateWindow is not None:
+                nano, power, aboveThresh = decimate_peaks( nano, power, aboveThresh, decimateWindow )
+            outputFile.write( encode_data_packets( version, nano, power, aboveThresh, phaseDiffs[i] ).tobytes() )
+            statusWords = encode_status_packets( version, epochs[i:i+1], triggerCount, id=id, netid=netid,
+                                                 phaseDiffs=phaseDiffs[i], gpsInfo=gpsInfo if version < 10 else gpsInfo[i] )
+            outputFile.write( statusWords.tobytes() )
+
+def make_loc_file( nStations=10, center=(35.0, -97.0, 400.0), radius=50000., name='Synthetic', seed=None ):
+    """
+    Makes a LocFile with stations scattered around center
+
+    nStations - number of stations, ids are A, B, C, ...
+    center    - network center (lat, lon, alt)
+    radius    - stations are within this many meters of the center
+    """
+    rng = np.random.default_rng( seed )
+    locFile = raw_io.LocFile()
+    locFile.network = raw_io.Station( name=name, geodetic=tuple( center ), cartesian=latlonalt2xyz( *center ) )
+    for i in range( nStations ):
+        #uniform over the disk
+        r     = radius*np.sqrt( rng.uniform() )
+        theta = rng.uniform( 0, 2*np.pi )
+        lat   = center[0] + r*np.cos( theta )/Earc
+        lon   = center[1] + r*np.sin( theta )/( Earc*np.cos( center[0]*np.pi/180 ) )
+        alt   = center[2] + rng.uniform( -50, 50 )
+        geodetic = ( float(lat), float(lon), float(alt) )
+        locFile.add( raw_io.Station( name='Station%i'%i, id=chr( 65+i ), geodetic=geodetic,
+                                     cartesian=latlonalt2xyz( *geodetic ), delay=0.0, boardVersion=12, channel=3 ) )
+    return locFile